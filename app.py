@@ -1,29 +1,60 @@
-from src.document_agent import search_medical_info
 import sys
 import os
+import re
 import sqlite3
 import secrets
-from typing import Dict, List
+import hashlib
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict, deque
+from itertools import groupby
+from typing import Deque, Dict, List, Sequence
 from datetime import datetime
+from urllib.parse import parse_qsl
 from werkzeug.utils import secure_filename
 
 from flask import Flask, jsonify, request, send_file, render_template, g, make_response
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from flask_sock import Sock
 from dotenv import load_dotenv
+import orjson
 
-from src import initialize_llm, parse_results, initialize_sql_agent, initialize_summary_agent, generate_consultation_summary, generate_patient_problem_summary, initialize_document_agent, analyze_lab_report
 # Authentication module - uses Flask session cookies to remember logged-in users
 from src.auth import (
     register_user, login_user, logout_user,
     get_current_user, login_required, doctor_required, admin_required,
     get_doctor_for_user
 )
+from src.db_pool import acquire_conn, release_conn
+from src.appointments import book_slot, cancel_slot
+from src.timing import timed, render_metrics
 from config import *
 
 # --- Load env ---
 load_dotenv()
 
+# --- Logging ---
+# Request/WebSocket threads only enqueue log records; a QueueListener thread
+# does the formatting and stderr writes. Per-request traces are DEBUG, so they
+# cost a level check unless LOG_LEVEL=DEBUG is set.
+log = logging.getLogger('healthassistant')
+log.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+log.propagate = False
+
+_log_queue = queue.SimpleQueue()
+_log_stream_handler = logging.StreamHandler()
+_log_stream_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_stream_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+log.addHandler(logging.handlers.QueueHandler(_log_queue))
+
 
 def get_current_user_name():
     """
@@ -40,27 +71,158 @@ UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'assets', 'uploads')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf', 'doc', 'docx'}
 MAX_FILE_SIZE = 2 * 1024 * 1024  # 2MB in bytes
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+os.makedirs(CHAT_HISTORY_FOLDER, exist_ok=True)
+
+_ALLOWED_EXTENSIONS = frozenset(ALLOWED_EXTENSIONS)
 
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    if not filename:
+        return False
+    _, dot, ext = filename.rpartition('.')
+    return bool(dot) and ext.lower() in _ALLOWED_EXTENSIONS
+
+# Chat history lines look like: [DD-MM-YYYY HH:MM:SS] role: message
+CHAT_TAIL_BYTES = 64 * 1024  # how much history the doctor patient view reads
+_CHAT_HEADER_RE = re.compile(r'^\[(\d{2}-\d{2}-\d{4} \d{2}:\d{2}:\d{2})\] (user|bot): (.*)$')
+
+def parse_chat_history_file(filepath: str, max_bytes: int = None) -> list:
+    """
+    Parse a chat history file line by line into a list of
+    {'timestamp', 'role', 'text'} dicts. Lines that are not a message
+    header are appended to the current message (multi-line messages).
+    
+    :param max_bytes: Only read the last max_bytes of the file (whole file if None)
+    """
+    messages = []
+    current = None  # (timestamp, role, [text lines])
+    
+    def flush():
+        if current:
+            messages.append({
+                'timestamp': current[0],
+                'role': current[1],
+                'text': '\n'.join(current[2]).strip()
+            })
+    
+    with open(filepath, 'rb') as f:
+        if max_bytes is not None:
+            f.seek(0, os.SEEK_END)
+            start = max(0, f.tell() - max_bytes)
+            f.seek(start)
+            if start:
+                f.readline()  # drop the partial line we landed in
+        # Lines before the first header belong to a message that started
+        # outside the window; the state machine skips them (current is None)
+        for raw in f:
+            line = raw.decode('utf-8', 'ignore').rstrip('\r\n')
+            match = _CHAT_HEADER_RE.match(line)
+            if match:
+                flush()
+                current = (match[1], match[2], [match[3]])
+            elif current:
+                current[2].append(line)
+    flush()
+    return messages
+
+# Parsed chat histories keyed by path, reused while the file's
+# (mtime, size) is unchanged
+_chat_history_cache = {}
+_chat_history_cache_lock = threading.Lock()
+
+def read_chat_history_cached(filepath: str) -> list:
+    """
+    Like parse_chat_history_file(), but returns the previously parsed
+    messages when the file has not changed since the last call.
+    The returned list is shared: callers must not modify it.
+    """
+    st = os.stat(filepath)
+    key = (st.st_mtime_ns, st.st_size)
+    with _chat_history_cache_lock:
+        cached = _chat_history_cache.get(filepath)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    
+    messages = parse_chat_history_file(filepath)
+    with _chat_history_cache_lock:
+        _chat_history_cache[filepath] = (key, messages)
+    return messages
+
+# Chat messages are queued per user and appended by a background writer,
+# so each file is opened once per flush instead of once per message.
+CHAT_FLUSH_INTERVAL = 0.25  # coalescing window after the first queued line
+CHAT_FLUSH_MAX_PENDING = 50 # flush early once this many lines are queued
+
+_chat_queue = defaultdict(list)
+_chat_lock = threading.Lock()
+_chat_pending = 0
+_chat_wakeup = threading.Event()     # queue went from empty to non-empty
+_chat_flush_now = threading.Event()  # too many lines pending: skip the window
+
+def _chat_history_path(user_key: str) -> str:
+    return os.path.join(CHAT_HISTORY_FOLDER, f"{user_key}.txt")
+
+def flush_chat_messages(user_name: str = None):
+    """
+    Write queued chat messages to disk.
+    
+    :param user_name: Flush only this user's queue (all users if None)
+    """
+    global _chat_queue, _chat_pending
+    with _chat_lock:
+        if user_name is None:
+            pending, _chat_queue = _chat_queue, defaultdict(list)
+            _chat_pending = 0
+        else:
+            user_key = user_name.lower()
+            lines = _chat_queue.pop(user_key, None)
+            if not lines:
+                return
+            pending = {user_key: lines}
+            _chat_pending -= len(lines)
+        
+        # Writes happen under the lock so per-user ordering is preserved
+        # when a targeted flush races with the background writer.
+        for user_key, lines in pending.items():
+            with open(_chat_history_path(user_key), 'a', encoding='utf-8', buffering=64 * 1024) as f:
+                f.write("".join(lines))
+
+def _chat_writer_loop():
+    # Sleeps until something is queued, then waits one coalescing window so
+    # a user turn and its bot reply usually land in the same write
+    while True:
+        _chat_wakeup.wait()
+        _chat_flush_now.wait(CHAT_FLUSH_INTERVAL)
+        _chat_wakeup.clear()
+        _chat_flush_now.clear()
+        try:
+            flush_chat_messages()
+        except OSError as e:
+            log.error("Chat history flush error: %s", e)
 
 def save_chat_message(role: str, message: str, user_name: str = None):
     """
-    Save a chat message to the user's chat history file.
+    Queue a chat message for the user's chat history file.
+    Call flush_chat_messages() before reading the file back.
     
     :param role: 'user' or 'bot'
     :param message: The message text
     :param user_name: The user's name (optional, defaults to global USER_NAME)
     """
+    global _chat_pending
     if user_name is None:
         user_name = USER_NAME
-    os.makedirs(CHAT_HISTORY_FOLDER, exist_ok=True)
-    print("the username for chat history is",user_name)
-    filepath = os.path.join(CHAT_HISTORY_FOLDER, f"{user_name.lower()}.txt")
+    log.debug("the username for chat history is %s", user_name)
     timestamp = datetime.now().strftime("%d-%m-%Y %H:%M:%S")
     
-    with open(filepath, 'a', encoding='utf-8') as f:
-        f.write(f"[{timestamp}] {role}: {message}\n\n")
+    with _chat_lock:
+        _chat_queue[user_name.lower()].append(f"[{timestamp}] {role}: {message}\n\n")
+        _chat_pending += 1
+        _chat_wakeup.set()
+        if _chat_pending >= CHAT_FLUSH_MAX_PENDING:
+            _chat_flush_now.set()
+
+threading.Thread(target=_chat_writer_loop, name="chat-history-writer", daemon=True).start()
+atexit.register(flush_chat_messages)
 
 def ensure_user_chat_history_exists(user_name: str = None):
     """
@@ -69,54 +231,249 @@ def ensure_user_chat_history_exists(user_name: str = None):
     """
     if user_name is None:
         user_name = USER_NAME
-    os.makedirs(CHAT_HISTORY_FOLDER, exist_ok=True)
     filepath = os.path.join(CHAT_HISTORY_FOLDER, f"{user_name.lower()}.txt")
-    if not os.path.exists(filepath):
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write("")  # Create empty file
-        print(f"Created new chat history file for user: {user_name}")
-
-# Create chat history file for current user if it doesn't exist
-ensure_user_chat_history_exists()
+    try:
+        # 'x' creates the file and fails if it exists: one syscall instead of stat + open
+        with open(filepath, 'x', encoding='utf-8'):
+            pass
+        log.info("Created new chat history file for user: %s", user_name)
+    except FileExistsError:
+        pass
 
 # --- Initialize LLM / Agent ---
 """try:
     agent = initialize_llm(USER_NAME, HOST, k=K, max_tokens=MAX_TOKENS, temp=T)
-    print("LLM agent initialized")
+    log.info("LLM agent initialized")
 except Exception as e:
-    print("LLM init error:", e)
+    log.error("LLM init error: %s", e)
     sys.exit(1)
 """
 # --- Initialize SQL Agent ---
 """try:
     sql_agent = initialize_sql_agent(USER_NAME, max_tokens=MAX_TOKENS, temp=T)
-    print("SQL agent initialized")
+    log.info("SQL agent initialized")
 except Exception as e:
-    print("SQL agent init error:", e)
+    log.error("SQL agent init error: %s", e)
     sys.exit(1)
 """
-# --- Initialize Summary Agent ---
-try:
-    summary_llm = initialize_summary_agent(max_tokens=MAX_TOKENS, temp=T)
-    print("Summary agent initialized")
-except Exception as e:
-    print("Summary agent init error:", e)
-    sys.exit(1)
+# --- Summary / Document Agents (lazy) ---
+# Model and embedding loads are deferred to first use so the server starts
+# immediately; endpoints that never touch them stay fast.
+_summary_llm = None
+_summary_lock = threading.Lock()
+
+def get_summary_llm():
+    """
+    Returns the Summary Agent LLM, initializing it on first call.
+    """
+    global _summary_llm
+    if _summary_llm is None:
+        with _summary_lock:
+            if _summary_llm is None:
+                from src import initialize_summary_agent
+                _summary_llm = initialize_summary_agent(max_tokens=MAX_TOKENS, temp=T)
+                log.info("Summary agent initialized")
+    return _summary_llm
+
+_problem_llm = None
+
+def get_problem_llm():
+    """
+    Returns the LLM for patient problem summaries: a 1-2 sentence answer, so
+    it stops after PROBLEM_MAX_TOKENS tokens or at the first blank line.
+    """
+    global _problem_llm
+    if _problem_llm is None:
+        with _summary_lock:
+            if _problem_llm is None:
+                from src import initialize_summary_agent
+                _problem_llm = initialize_summary_agent(max_tokens=PROBLEM_MAX_TOKENS, temp=T, stop=("\n\n",))
+    return _problem_llm
+
+_document_agent = None
+_document_lock = threading.Lock()
+
+def get_document_agent():
+    """
+    Returns (document_llm, doc_retriever), initializing them on first call.
+    If initialization fails, (None, None) is cached and document analysis stays disabled.
+    """
+    global _document_agent
+    if _document_agent is None:
+        with _document_lock:
+            if _document_agent is None:
+                try:
+                    from src import initialize_document_agent
+                    _document_agent = initialize_document_agent(max_tokens=MAX_TOKENS, temp=T)
+                    log.info("Document agent initialized")
+                except Exception as e:
+                    log.error("Document agent init error: %s", e)
+                    log.warning("Document agent NOT available - PDF analysis will be disabled")
+                    _document_agent = (None, None)
+    return _document_agent
+
+# --- Lab report analysis jobs ---
+# Analysis takes seconds of LLM time, so it runs on a small worker pool and
+# the client polls /api/lab-report-status/<job_id> for the result.
+LAB_REPORT_WORKERS = 2
+LAB_REPORT_JOB_TTL = 3600  # finished jobs nobody polled are dropped after this (s)
+_lab_report_executor = ThreadPoolExecutor(max_workers=LAB_REPORT_WORKERS, thread_name_prefix='lab-report')
+_lab_report_jobs = {}  # job_id -> {'user_id', 'future', 'created'}
+_lab_report_jobs_lock = threading.Lock()
+
+def _run_lab_report_analysis(document_llm, doc_retriever, file_path, user_name):
+    """
+    Worker body: analyzes the report and saves the result to the user's chat history.
+    """
+    from src import analyze_lab_report
+    analysis_result = analyze_lab_report(document_llm, doc_retriever, file_path)
+    save_chat_message("bot", f"Lab Report Analysis:\n{analysis_result}", user_name)
+    return analysis_result
+
+def submit_lab_report_job(user_id, *args) -> str:
+    """
+    Queues a lab report analysis and returns its job id.
+    """
+    job_id = secrets.token_urlsafe(16)
+    now = time.monotonic()
+    with _lab_report_jobs_lock:
+        for stale in [jid for jid, job in _lab_report_jobs.items()
+                      if job['future'].done() and now - job['created'] > LAB_REPORT_JOB_TTL]:
+            del _lab_report_jobs[stale]
+        _lab_report_jobs[job_id] = {
+            'user_id': user_id,
+            'future': _lab_report_executor.submit(_run_lab_report_analysis, *args),
+            'created': now,
+        }
+    return job_id
+
+# --- Semantic response cache (medical LLM branch) ---
+# One cache per user: the agent prompt is personalized and can look up the
+# user's appointments, so responses must never be shared across users.
+_semantic_caches = {}
+_semantic_caches_lock = threading.Lock()
+
+def _semantic_cache_path(user_name: str) -> str:
+    return os.path.join(SEMANTIC_CACHE_FOLDER, secure_filename(user_name.lower()))
 
-# --- Initialize Document Agent ---
+def get_semantic_cache(user_name: str, embeddings):
+    """
+    Returns the user's SemanticCache, loading it from disk on first use.
+    """
+    user_key = user_name.lower()
+    with _semantic_caches_lock:
+        cache = _semantic_caches.get(user_key)
+        if cache is None:
+            from src.semantic_cache import SemanticCache
+            cache = SemanticCache(embeddings, threshold=SEMANTIC_CACHE_THRESHOLD,
+                                  max_entries=SEMANTIC_CACHE_MAX_ENTRIES, ttl=SEMANTIC_CACHE_TTL)
+            try:
+                cache.load(_semantic_cache_path(user_name))
+            except Exception as e:
+                log.warning("Could not load semantic cache for %s: %s", user_name, e)
+            _semantic_caches[user_key] = cache
+        return cache
+
+def save_semantic_caches():
+    """
+    Persist all semantic caches (called at shutdown).
+    """
+    with _semantic_caches_lock:
+        caches = list(_semantic_caches.items())
+    for user_key, cache in caches:
+        try:
+            cache.save(_semantic_cache_path(user_key))
+        except Exception as e:
+            log.error("Could not save semantic cache for %s: %s", user_key, e)
+
+atexit.register(save_semantic_caches)
+
+# --- Create tables and indexes ---
+# The documents table is created here (in case the DB predates the feature)
+# rather than on every upload/list request.
+# Doctor endpoints filter by doctor, then by patient, ordered by time_slot.
+# The LOWER() expression indexes back the case-insensitive patient lookups.
+# The partial index holds only free slots in time order, for the
+# available-slot listings of the chat agents.
 try:
-    document_llm, doc_retriever = initialize_document_agent(max_tokens=MAX_TOKENS, temp=T)
-    print("Document agent initialized")
-except Exception as e:
-    print("Document agent init error:", e)
-    document_llm, doc_retriever = None, None
-    print("Document agent NOT available - PDF analysis will be disabled")
+    index_db = sqlite3.connect(DB_PATH)
+    index_db.executescript("""
+        CREATE TABLE IF NOT EXISTS documents (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            patient_id TEXT,
+            patient_surname TEXT,
+            document_path TEXT,
+            upload_date TEXT,
+            description TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_appt_doctor_patient_time ON appointments(doctor, patient, time_slot);
+        CREATE INDEX IF NOT EXISTS idx_appt_patient_lower ON appointments(LOWER(patient));
+        CREATE INDEX IF NOT EXISTS idx_appt_free_time ON appointments(time_slot) WHERE patient IS NULL;
+        CREATE INDEX IF NOT EXISTS idx_docs_patient_lower ON documents(LOWER(patient_surname));
+        CREATE INDEX IF NOT EXISTS idx_docs_patient_id_lower ON documents(LOWER(patient_id));
+    """)
+    index_db.close()
+    log.info("Database tables and indexes ready")
+except sqlite3.Error as e:
+    log.error("Database table/index creation error: %s", e)
+
+# Case-insensitive uniqueness of usernames and emails. These back the lookups
+# on every login and let registration rely on the INSERT alone (race-free).
+# They replace the earlier non-unique idx_users_*_lower indexes.
+try:
+    users_db = sqlite3.connect(DB_PATH)
+    users_db.executescript("""
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_users_username_lower ON users(LOWER(username));
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_users_email_lower ON users(LOWER(email));
+        DROP INDEX IF EXISTS idx_users_username_lower;
+        DROP INDEX IF EXISTS idx_users_email_lower;
+    """)
+    users_db.close()
+except sqlite3.IntegrityError as e:
+    log.error("Users table has case-insensitive duplicate usernames/emails, unique indexes not created: %s", e)
+except sqlite3.Error as e:
+    log.error("Users index creation error: %s", e)
+
+# --- Appointments version counter (for doctor endpoint ETags) ---
+# Triggers bump a single counter on any change to appointments, so a doctor
+# view can be revalidated with one primary-key read instead of its queries.
+try:
+    version_db = sqlite3.connect(DB_PATH)
+    version_db.executescript("""
+        CREATE TABLE IF NOT EXISTS appointments_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO appointments_version (id, version) VALUES (1, 0);
+        CREATE TRIGGER IF NOT EXISTS trg_appt_version_insert AFTER INSERT ON appointments
+        BEGIN UPDATE appointments_version SET version = version + 1 WHERE id = 1; END;
+        CREATE TRIGGER IF NOT EXISTS trg_appt_version_update AFTER UPDATE ON appointments
+        BEGIN UPDATE appointments_version SET version = version + 1 WHERE id = 1; END;
+        CREATE TRIGGER IF NOT EXISTS trg_appt_version_delete AFTER DELETE ON appointments
+        BEGIN UPDATE appointments_version SET version = version + 1 WHERE id = 1; END;
+    """)
+    version_db.close()
+except sqlite3.Error as e:
+    log.error("Appointments version setup error: %s", e)
 
 # =============================================================================
 # FLASK APP SETUP
 # =============================================================================
 
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    JSON provider backed by orjson: jsonify() and request.get_json() use it.
+    Types orjson can't handle fall back to Flask's default conversion.
+    """
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 # Allow frontend to make requests to backend (CORS = Cross-Origin Resource Sharing)
 CORS(app, 
@@ -127,8 +484,31 @@ CORS(app,
 sock = Sock(app)
 
 # Secret key for signing session cookies
-# In production, set SECRET_KEY environment variable to a fixed value
-app.secret_key = os.environ.get('SECRET_KEY', secrets.token_hex(32))
+# In production, set SECRET_KEY environment variable to a fixed value.
+# Otherwise a key is generated on first boot and persisted, so restarts and
+# multiple workers share it instead of invalidating every session cookie.
+SECRET_KEY_FILE = os.path.join(os.path.dirname(__file__), '.flask_secret')
+
+def _load_secret_key() -> str:
+    if 'SECRET_KEY' in os.environ:
+        return os.environ['SECRET_KEY']
+    try:
+        with open(SECRET_KEY_FILE, 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+    key = secrets.token_hex(32)
+    try:
+        fd = os.open(SECRET_KEY_FILE, os.O_CREAT | os.O_WRONLY | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # Another worker created it first: use that key
+        with open(SECRET_KEY_FILE, 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(key)
+    return key
+
+app.secret_key = _load_secret_key()
 
 # Configure Flask sessions
 from datetime import timedelta
@@ -136,8 +516,89 @@ app.config['SESSION_COOKIE_HTTPONLY'] = True   # Cookie not accessible via JavaS
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'  # CSRF protection
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=24)  # Session expires after 24h
 
+# Behind nginx/Apache, let the front server stream files (X-Sendfile) instead of Python
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+
+# Reject oversized uploads while parsing instead of after buffering the body.
+# The margin leaves room for multipart headers and the description field.
+# Werkzeug spools file parts above 500KB to a temporary file, not memory.
+app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE + 64 * 1024
+
+
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify({"error": "File too large. Maximum size is 2MB."}), 413
+
 # Store active WebSocket connections
-active_connections: Dict[int, List[dict]] = {}
+active_connections: Dict[int, Deque[dict]] = {}
+
+
+# =============================================================================
+# DATABASE CONNECTION
+# =============================================================================
+
+def get_db():
+    """
+    Get the SQLite connection for the current request.
+    The connection is borrowed from the process-wide pool on first use and
+    kept until the request ends, so handlers reuse an already-tuned
+    connection with a warm page cache.
+    """
+    db = getattr(g, '_db', None)
+    if db is None:
+        db = g._db = acquire_conn()
+    return db
+
+
+@app.teardown_appcontext
+def close_db(exception):
+    """
+    Return the request's SQLite connection to the pool (if one was borrowed).
+    """
+    db = g.pop('_db', None)
+    if db is not None:
+        release_conn(db)
+
+
+# =============================================================================
+# HTTP CACHING (doctor endpoints)
+# =============================================================================
+
+DOCTOR_CACHE_CONTROL = 'private, max-age=10'
+
+def appointments_etag(doctor_name: str) -> str | None:
+    """
+    ETag for a doctor's appointment-derived views.
+    Changes whenever any appointment row changes. Returns None if the
+    version counter is unavailable (responses are then sent uncached).
+    """
+    try:
+        row = get_db().execute("SELECT version FROM appointments_version WHERE id = 1").fetchone()
+    except sqlite3.Error:
+        return None
+    if row is None:
+        return None
+    return hashlib.md5(f"{doctor_name}:{row[0]}".encode()).hexdigest()
+
+def not_modified_response(etag: str | None):
+    """
+    Returns a 304 response if the client already has this ETag, else None.
+    """
+    if etag is None or etag not in request.if_none_match:
+        return None
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = DOCTOR_CACHE_CONTROL
+    return response
+
+def with_cache_headers(response, etag: str | None):
+    """
+    Attach ETag / Cache-Control headers to a doctor endpoint response.
+    """
+    if etag is not None:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = DOCTOR_CACHE_CONTROL
+    return response
 
 
 # =============================================================================
@@ -157,7 +618,7 @@ def api_register():
         "full_name": "John Doe"
     }
     """
-    print("POST /api/auth/register called")
+    log.debug("POST /api/auth/register called")
     
     # Get JSON data from request body
     data = request.get_json()
@@ -195,7 +656,7 @@ def api_login():
         "password": "SecurePass123!"
     }
     """
-    print("POST /api/auth/login called")
+    log.debug("POST /api/auth/login called")
     
     data = request.get_json()
     if not data:
@@ -226,7 +687,7 @@ def api_logout():
     """
     Log out the current user by clearing the session.
     """
-    print("POST /api/auth/logout called")
+    log.debug("POST /api/auth/logout called")
     
     # Clear Flask session
     logout_user()#session.clear()
@@ -242,7 +703,7 @@ def api_get_current_user():
     """
     Get the current authenticated user.
     """
-    print("GET /api/auth/me called")
+    log.debug("GET /api/auth/me called")
     
     user = get_current_user()
     
@@ -271,7 +732,7 @@ def api_doctor_patients():
     """
     Get all patients who have appointments with the current doctor.
     """
-    print("GET /api/doctor/patients called")
+    log.debug("GET /api/doctor/patients called")
     
     user = g.current_user
     doctor_info = get_doctor_for_user(user['user_id'])
@@ -281,8 +742,12 @@ def api_doctor_patients():
     
     doctor_name = doctor_info['name']
     
-    db = sqlite3.connect(DB_PATH)
-    cur = db.cursor()
+    etag = appointments_etag(doctor_name)
+    cached = not_modified_response(etag)
+    if cached is not None:
+        return cached
+    
+    cur = get_db().cursor()
     
     # Get all unique patients with their appointments
     query = """
@@ -294,7 +759,6 @@ def api_doctor_patients():
     
     result = cur.execute(query, (doctor_name,))
     rows = result.fetchall()
-    db.close()
     
     # Group appointments by patient
     patients_dict = {}
@@ -313,11 +777,11 @@ def api_doctor_patients():
     
     patients = list(patients_dict.values())
     
-    return jsonify({
+    return with_cache_headers(jsonify({
         'doctor': doctor_info,
         'patients': patients,
         'total_patients': len(patients)
-    })
+    }), etag)
 
 
 @app.get("/api/doctor/appointments")
@@ -327,7 +791,7 @@ def api_doctor_appointments():
     """
     Get all appointments for the current doctor.
     """
-    print("GET /api/doctor/appointments called")
+    log.debug("GET /api/doctor/appointments called")
     
     user = g.current_user
     doctor_info = get_doctor_for_user(user['user_id'])
@@ -337,8 +801,12 @@ def api_doctor_appointments():
     
     doctor_name = doctor_info['name']
     
-    db = sqlite3.connect(DB_PATH)
-    cur = db.cursor()
+    etag = appointments_etag(doctor_name)
+    cached = not_modified_response(etag)
+    if cached is not None:
+        return cached
+    
+    cur = get_db().cursor()
     
     # Get all appointments (both booked and available)
     query = """
@@ -348,24 +816,19 @@ def api_doctor_appointments():
         ORDER BY a.time_slot
     """
     
-    result = cur.execute(query, (doctor_name,))
-    appointments = [
-        {
+    # Separate into booked and available in a single pass over the cursor
+    booked, available = [], []
+    for r in cur.execute(query, (doctor_name,)):
+        entry = {
             'slot_id': r[0],
             'time_slot': r[1],
             'patient': r[2],
             'patient_problem': r[3],
             'status': 'booked' if r[2] else 'available'
         }
-        for r in result.fetchall()
-    ]
-    db.close()
+        (booked if r[2] else available).append(entry)
     
-    # Separate into booked and available
-    booked = [a for a in appointments if a['status'] == 'booked']
-    available = [a for a in appointments if a['status'] == 'available']
-    
-    return jsonify({
+    return with_cache_headers(jsonify({
         'doctor': doctor_info,
         'appointments': {
             'booked': booked,
@@ -373,7 +836,7 @@ def api_doctor_appointments():
             'total_booked': len(booked),
             'total_available': len(available)
         }
-    })
+    }), etag)
 
 
 @app.get("/api/doctor/patient/<patient_name>")
@@ -383,10 +846,15 @@ def api_doctor_patient_detail(patient_name):
     """
     Get detailed information about a specific patient including chat history.
     """
-    print(f"GET /api/doctor/patient/{patient_name} called")
+    log.debug("GET /api/doctor/patient/%s called", patient_name)
+    
+    # Optional ?limit=N: only the last N chat messages
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit <= 0:
+        return jsonify({"error": "limit must be a positive integer"}), 400
     
     user = g.current_user
-    print("user is:",user)
+    log.debug("user is: %s", user)
     doctor_info = get_doctor_for_user(user['user_id'])
     
     if not doctor_info:
@@ -394,19 +862,7 @@ def api_doctor_patient_detail(patient_name):
     
     doctor_name = doctor_info['name']
     
-    db = sqlite3.connect(DB_PATH)
-    cur = db.cursor()
-    
-    # Verify this patient has an appointment with this doctor
-    verify_query = """
-        SELECT COUNT(*) FROM appointments
-        WHERE doctor = ? AND LOWER(patient) = LOWER(?)
-    """
-    result = cur.execute(verify_query, (doctor_name, patient_name)).fetchone()
-    
-    if result[0] == 0:
-        db.close()
-        return jsonify({"error": "Patient not found or not assigned to you"}), 404
+    cur = get_db().cursor()
     
     # Get patient's appointments with this doctor
     appointments_query = """
@@ -426,6 +882,10 @@ def api_doctor_patient_detail(patient_name):
         for r in result.fetchall()
     ]
     
+    # No appointments means this patient is not assigned to this doctor
+    if not appointments:
+        return jsonify({"error": "Patient not found or not assigned to you"}), 404
+    
     # Get patient's documents (if any)
     docs_query = """
         SELECT id, document_path, upload_date, description
@@ -443,25 +903,16 @@ def api_doctor_patient_detail(patient_name):
         }
         for r in result.fetchall()
     ]
-    db.close()
     
     # Get patient's chat history
     chat_history = []
+    flush_chat_messages(patient_name)
     chat_path = os.path.join(CHAT_HISTORY_FOLDER, f"{patient_name.lower()}.txt")
     if os.path.exists(chat_path):
-        import re
-        with open(chat_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-            pattern = r'\[(\d{2}-\d{2}-\d{4} \d{2}:\d{2}:\d{2})\] (user|bot): (.+?)(?=\n\[|\Z)'
-            matches = re.findall(pattern, content, re.DOTALL)
-            
-            for match in matches:
-                timestamp, role, text = match
-                chat_history.append({
-                    'timestamp': timestamp,
-                    'role': role,
-                    'text': text.strip()
-                })
+        # Doctors need recent context: parse only the tail of long histories
+        chat_history = parse_chat_history_file(chat_path, max_bytes=CHAT_TAIL_BYTES)
+        if limit:
+            chat_history = chat_history[-limit:]
     
     return jsonify({
         'patient': {
@@ -482,7 +933,7 @@ def api_doctor_generate_problem(appointment_id):
     Generate patient problem summary from chat history for a specific appointment.
     Only the doctor assigned to this appointment can generate the summary.
     """
-    print(f"POST /api/doctor/generate-problem/{appointment_id} called")
+    log.debug("POST /api/doctor/generate-problem/%s called", appointment_id)
     
     user = g.current_user
     doctor_info = get_doctor_for_user(user['user_id'])
@@ -492,40 +943,42 @@ def api_doctor_generate_problem(appointment_id):
     
     doctor_name = doctor_info['name']
     
-    db = sqlite3.connect(DB_PATH)
-    cur = db.cursor()
+    db = get_db()
     
-    # Verify this appointment belongs to this doctor and get patient name
+    # Verify this appointment belongs to this doctor and get patient name.
+    # This is a plain read: no transaction is open while the LLM runs below.
     verify_query = """
-        SELECT id, patient, doctor FROM appointments
+        SELECT patient, doctor FROM appointments
         WHERE id = ?
     """
-    result = cur.execute(verify_query, (appointment_id,)).fetchone()
+    result = db.execute(verify_query, (appointment_id,)).fetchone()
     
     if not result:
-        db.close()
         return jsonify({"error": "Appointment not found"}), 404
     
-    if result[2] != doctor_name:
-        db.close()
+    if result[1] != doctor_name:
         return jsonify({"error": "You can only generate summaries for your own patients"}), 403
     
-    patient_name = result[1]
+    patient_name = result[0]
     
     if not patient_name:
-        db.close()
         return jsonify({"error": "This appointment has no patient assigned"}), 400
     
+    # Give the connection back to the pool while the LLM runs
+    close_db(None)
+    
     # Generate the patient problem summary
     try:
-        patient_problem = generate_patient_problem_summary(summary_llm, patient_name)
-        print(f"Generated patient problem for {patient_name}: {patient_problem}")
+        from src import generate_patient_problem_summary
+        flush_chat_messages(patient_name)
+        patient_problem = generate_patient_problem_summary(get_problem_llm(), patient_name)
+        log.debug("Generated patient problem for %s: %s", patient_name, patient_problem)
         
-        # Update the appointment with the generated problem
-        update_query = "UPDATE appointments SET patient_problem = ? WHERE id = ?"
-        cur.execute(update_query, (patient_problem, appointment_id))
-        db.commit()
-        db.close()
+        # Update the appointment with the generated problem in a short transaction
+        update_query = "UPDATE appointments SET patient_problem = ? WHERE id = ? AND doctor = ?"
+        db = get_db()
+        with db:
+            db.execute(update_query, (patient_problem, appointment_id, doctor_name))
         
         return jsonify({
             "success": True,
@@ -533,8 +986,7 @@ def api_doctor_generate_problem(appointment_id):
             "message": "Problem summary generated successfully"
         })
     except Exception as e:
-        db.close()
-        print(f"Error generating patient problem: {e}")
+        log.error("Error generating patient problem: %s", e)
         return jsonify({"error": f"Failed to generate summary: {str(e)}"}), 500
 
 
@@ -545,7 +997,7 @@ def api_doctor_dashboard():
     """
     Get dashboard data for the doctor.
     """
-    print("GET /api/doctor/dashboard called")
+    log.debug("GET /api/doctor/dashboard called")
     
     user = g.current_user
     doctor_info = get_doctor_for_user(user['user_id'])
@@ -555,30 +1007,23 @@ def api_doctor_dashboard():
     
     doctor_name = doctor_info['name']
     
-    db = sqlite3.connect(DB_PATH)
-    cur = db.cursor()
+    etag = appointments_etag(doctor_name)
+    cached = not_modified_response(etag)
+    if cached is not None:
+        return cached
     
-    # Count total patients
-    patients_query = """
-        SELECT COUNT(DISTINCT patient) FROM appointments
-        WHERE doctor = ? AND patient IS NOT NULL
-    """
-    total_patients = cur.execute(patients_query, (doctor_name,)).fetchone()[0]
+    cur = get_db().cursor()
     
-    # Count upcoming appointments (booked)
-    booked_query = """
-        SELECT COUNT(*) FROM appointments
-        WHERE doctor = ? AND patient IS NOT NULL
+    # Count patients, booked appointments and available slots in one pass
+    stats_query = """
+        SELECT COUNT(DISTINCT patient),
+               COALESCE(SUM(CASE WHEN patient IS NOT NULL THEN 1 ELSE 0 END), 0),
+               COALESCE(SUM(CASE WHEN patient IS NULL THEN 1 ELSE 0 END), 0)
+        FROM appointments
+        WHERE doctor = ?
     """
-    total_booked = cur.execute(booked_query, (doctor_name,)).fetchone()[0]
-    
-    # Count available slots
-    available_query = """
-        SELECT COUNT(*) FROM appointments
-        WHERE doctor = ? AND patient IS NULL
-    """
-    total_available = cur.execute(available_query, (doctor_name,)).fetchone()[0]
-    
+    total_patients, total_booked, total_available = cur.execute(stats_query, (doctor_name,)).fetchone()
+
     # Get next 5 upcoming appointments
     upcoming_query = """
         SELECT a.id, a.time_slot, a.patient, a.patient_problem
@@ -597,10 +1042,8 @@ def api_doctor_dashboard():
         }
         for r in result.fetchall()
     ]
-    
-    db.close()
-    
-    return jsonify({
+
+    return with_cache_headers(jsonify({
         'doctor': doctor_info,
         'stats': {
             'total_patients': total_patients,
@@ -608,7 +1051,7 @@ def api_doctor_dashboard():
             'total_available': total_available
         },
         'upcoming_appointments': upcoming
-    })
+    }), etag)
 
 # --- Router keywords for SQL Agent ---
 SQL_AGENT_KEYWORDS = [
@@ -635,89 +1078,102 @@ SUMMARY_AGENT_KEYWORDS = [
     "give me a summary", "show summary",
 ]
 
+# Keyword lists compiled once into a single alternation (substring match, case-insensitive)
+_SQL_AGENT_RE = re.compile('|'.join(map(re.escape, SQL_AGENT_KEYWORDS)), re.IGNORECASE)
+_SUMMARY_AGENT_RE = re.compile('|'.join(map(re.escape, SUMMARY_AGENT_KEYWORDS)), re.IGNORECASE)
+
+# Within the SQL branch: does the user want to see the slot list?
+SLOT_LISTING_KEYWORDS = ["slot", "available", "show", "see"]
+_SLOT_LISTING_RE = re.compile('|'.join(map(re.escape, SLOT_LISTING_KEYWORDS)), re.IGNORECASE)
+
 def should_use_sql_agent(message: str) -> bool:
     """
     Determines if the user message requires the SQL Agent.
     """
-    msg_lower = message.lower()
-    return any(keyword in msg_lower for keyword in SQL_AGENT_KEYWORDS)
+    return _SQL_AGENT_RE.search(message) is not None
+
+# Doctor roster helpers are hit on every chat message but the roster rarely
+# changes, so a single snapshot (names, specializations, formatted list) is
+# built from one query and reused for DOCTOR_CACHE_TTL seconds (config.py).
+_doctor_cache = {'val': None, 'ts': 0.0}
+
+def _doctor_snapshot() -> tuple:
+    now = time.monotonic()
+    cached = _doctor_cache['val']
+    if cached is not None and now - _doctor_cache['ts'] < DOCTOR_CACHE_TTL:
+        return cached
+    
+    cur = get_db().cursor()
+    query = "SELECT name, specialization FROM doctors ORDER BY specialization, name"
+    with timed("sqlite.doctor_snapshot"):
+        rows = cur.execute(query).fetchall()
+    
+    names = tuple(name for name, _ in rows)
+    specs = tuple(dict.fromkeys(spec for _, spec in rows))
+    
+    if rows:
+        # Rows are already ordered by specialization, so group consecutively
+        lines = ["AVAILABLE DOCTORS IN OUR SYSTEM:"]
+        for spec, group in groupby(rows, key=lambda row: row[1]):
+            doctors_str = ", ".join(name for name, _ in group)
+            lines.append(f"- {spec}: {doctors_str}")
+        doctors_list = "\n".join(lines)
+    else:
+        doctors_list = "NO DOCTORS AVAILABLE in the system."
+    
+    # One case-insensitive alternation over all names (longest first) so a
+    # message can be scanned for mentioned doctors in a single pass
+    if names:
+        alternation = "|".join(map(re.escape, sorted(names, key=len, reverse=True)))
+        names_re = re.compile(alternation, re.IGNORECASE)
+    else:
+        names_re = None
+    
+    snapshot = (names, specs, doctors_list, names_re)
+    _doctor_cache.update(val=snapshot, ts=now)
+    return snapshot
 
 def get_all_doctors_list() -> str:
     """
     Retrieves all doctors with their specializations from the database.
     Returns a formatted string to include in the agent context.
     """
-    db = sqlite3.connect(DB_PATH)
-    cur = db.cursor()
-    
-    query = "SELECT name, specialization FROM doctors ORDER BY specialization, name"
-    result = cur.execute(query)
-    rows = result.fetchall()
-    db.close()
-    
-    if not rows:
-        return "NO DOCTORS AVAILABLE in the system."
-    
-    # Group by specialization
-    from collections import defaultdict
-    by_spec = defaultdict(list)
-    for name, spec in rows:
-        by_spec[spec].append(name)
-    
-    lines = ["AVAILABLE DOCTORS IN OUR SYSTEM:"]
-    for spec, doctors in sorted(by_spec.items()):
-        doctors_str = ", ".join(doctors)
-        lines.append(f"- {spec}: {doctors_str}")
-    
-    return "\n".join(lines)
+    return _doctor_snapshot()[2]
 
 def should_use_summary_agent(message: str) -> bool:
     """
     Determines if the user message requires the Summary Agent.
     """
-    msg_lower = message.lower()
-    return any(keyword in msg_lower for keyword in SUMMARY_AGENT_KEYWORDS)
+    return _SUMMARY_AGENT_RE.search(message) is not None
 
 def get_available_specializations() -> list:
     """
     Returns list of all specializations available in the database.
     """
-    db = sqlite3.connect(DB_PATH)
-    cur = db.cursor()
-    query = "SELECT DISTINCT specialization FROM doctors"
-    result = cur.execute(query)
-    specs = [row[0] for row in result.fetchall()]
-    db.close()
-    return specs
+    return list(_doctor_snapshot()[1])
 
 def get_all_doctor_names() -> list:
     """
     Returns list of all doctor names in the database.
     """
-    db = sqlite3.connect(DB_PATH)
-    cur = db.cursor()
-    query = "SELECT name FROM doctors"
-    result = cur.execute(query)
-    names = [row[0] for row in result.fetchall()]
-    db.close()
-    return names
+    return list(_doctor_snapshot()[0])
 
-def extract_mentioned_doctors_from_history(chat_history: list) -> list:
+def extract_mentioned_doctors_from_history(chat_history: Sequence[dict]) -> list:
     """
     Extracts doctor names mentioned in the last assistant message.
     Returns a list of doctor names found, or empty list if none.
     """
-    all_doctors = get_all_doctor_names()
+    all_doctors, _, _, names_re = _doctor_snapshot()
     mentioned_doctors = []
     
     # Cerca solo nell'ultimo messaggio dell'assistente
     for entry in reversed(chat_history):
         if entry.get("role") == "assistant":
             content = entry.get("content", "")
-            # Cerca ogni nome di dottore nel messaggio
-            for doctor_name in all_doctors:
-                if doctor_name.lower() in content.lower():
-                    mentioned_doctors.append(doctor_name)
+            if names_re is not None:
+                # Una sola scansione del messaggio per tutti i nomi dei dottori
+                found = {match.lower() for match in names_re.findall(content)}
+                mentioned_doctors = [name for name in all_doctors if name.lower() in found]
             break  # Solo l'ultimo messaggio dell'assistente
     
     return mentioned_doctors
@@ -730,22 +1186,22 @@ def get_slots_by_doctors(doctor_names: list) -> list:
     if not doctor_names:
         return []
     
-    db = sqlite3.connect(DB_PATH)
-    cur = db.cursor()
+    cur = get_db().cursor()
     
-    # Costruisci query con OR per ogni dottore
-    placeholders = " OR ".join(["LOWER(a.doctor) = LOWER(?)"] * len(doctor_names))
-    query = f"""
+    # Names come from get_all_doctor_names(), so they match doctors.name exactly
+    # and a plain IN (...) can use the (doctor, patient, time_slot) index.
+    # The names travel as one JSON array so the SQL text never changes and the
+    # connection's statement cache can reuse the compiled query.
+    query = """
         SELECT a.id, a.doctor, a.time_slot, d.specialization
         FROM appointments a
         JOIN doctors d ON a.doctor = d.name
-        WHERE a.patient IS NULL AND ({placeholders})
+        WHERE a.patient IS NULL AND a.doctor IN (SELECT value FROM json_each(?))
         ORDER BY a.time_slot
     """
     
-    result = cur.execute(query, doctor_names)
-    rows = result.fetchall()
-    db.close()
+    with timed("sqlite.slots_by_doctors"):
+        rows = cur.execute(query, (orjson.dumps(doctor_names).decode(),)).fetchall()
     
     return rows
 
@@ -754,18 +1210,17 @@ def get_slots_by_specialization(specialization: str | None) -> str:
     Gets available slots filtered by specialization.
     If specialization is None, returns all available slots.
     """
-    db = sqlite3.connect(DB_PATH)
-    cur = db.cursor()
+    cur = get_db().cursor()
     
     if specialization:
         query = """
             SELECT a.id, a.doctor, a.time_slot, d.specialization
             FROM appointments a
             JOIN doctors d ON a.doctor = d.name
-            WHERE a.patient IS NULL AND LOWER(d.specialization) = LOWER(?)
+            WHERE a.patient IS NULL AND d.specialization = ? COLLATE NOCASE
             ORDER BY a.time_slot
         """
-        result = cur.execute(query, (specialization,))
+        params = (specialization,)
     else:
         query = """
             SELECT a.id, a.doctor, a.time_slot, d.specialization
@@ -774,13 +1229,97 @@ def get_slots_by_specialization(specialization: str | None) -> str:
             WHERE a.patient IS NULL
             ORDER BY d.specialization, a.time_slot
         """
-        result = cur.execute(query)
+        params = ()
     
-    rows = result.fetchall()
-    db.close()
+    with timed("sqlite.slots_by_specialization"):
+        rows = cur.execute(query, params).fetchall()
     
     return rows
 
+def format_slots(header: str, slots: list) -> str:
+    """
+    Formats slot rows (id, doctor, time_slot, specialization) as a bulleted
+    list under header, one line per slot.
+    """
+    parts = [header]
+    parts.extend(f"- Slot ID {slot_id}: {doctor} ({spec}) - {time_slot}\n"
+                 for slot_id, doctor, time_slot, spec in slots)
+    return "".join(parts)
+
+def prefetch_slots_info(chat_history: Sequence[dict]) -> str:
+    """
+    Lists the free slots of the doctors mentioned in the last assistant
+    message, or all free slots if none were mentioned (or they have none).
+    """
+    mentioned_doctors = extract_mentioned_doctors_from_history(chat_history)
+    log.debug("Doctors mentioned in last response: %s", mentioned_doctors)
+    
+    if mentioned_doctors:
+        # Mostra solo gli slot dei medici menzionati
+        slots = get_slots_by_doctors(mentioned_doctors)
+        doctors_str = ", ".join(mentioned_doctors)
+        if slots:
+            return format_slots(f"AVAILABLE SLOTS FOR {doctors_str}:\n", slots)
+        # Nessuno slot per quei medici, mostra tutti
+        all_slots = get_slots_by_specialization(None)
+        if all_slots:
+            return format_slots(f"No slots available for {doctors_str}. Here are ALL available slots:\n", all_slots)
+        return "No appointment slots available at the moment."
+    
+    # Nessun medico menzionato, mostra tutti gli slot
+    all_slots = get_slots_by_specialization(None)
+    if all_slots:
+        return format_slots("ALL AVAILABLE SLOTS:\n", all_slots)
+    return "No appointment slots available at the moment."
+
+# --- Fast routes: plain lookups answered straight from the database ---
+# A message qualifies only if, once filler words are dropped, nothing but
+# the intent is left ("can you show me my appointments?" -> "my appointments"),
+# so anything with extra detail ("cancel my appointment on Monday") still
+# goes to the agent.
+FAST_ROUTE_FILLER = {
+    "please", "can", "could", "you", "i", "want", "would", "like", "to",
+    "show", "list", "see", "view", "get", "check", "give", "me", "what",
+    "which", "are", "is", "the", "all", "of", "a", "your",
+}
+FAST_ROUTE_INTENTS = {
+    "my appointments": "reservations", "my appointment": "reservations",
+    "my bookings": "reservations", "my reservations": "reservations",
+    "doctors": "doctors", "doctors list": "doctors", "doctor list": "doctors",
+    "available doctors": "doctors", "doctors available": "doctors",
+    "available slots": "slots", "free slots": "slots", "slots": "slots",
+    "slots available": "slots", "available appointments": "slots",
+}
+_WORD_RE = re.compile(r"[a-z]+")
+
+def fast_route(message: str, user_name: str, chat_history: Sequence[dict]) -> str | None:
+    """
+    Answers "my appointments", "doctors list" and "available slots" requests
+    without the agents, saving their LLM round-trips.
+    Returns the reply, or None if the message needs an agent.
+    """
+    words = [w for w in _WORD_RE.findall(message.lower()) if w not in FAST_ROUTE_FILLER]
+    intent = FAST_ROUTE_INTENTS.get(" ".join(words))
+    
+    if intent == "reservations":
+        query = """
+            SELECT a.id, a.doctor, a.time_slot, d.specialization
+            FROM appointments a
+            JOIN doctors d ON a.doctor = d.name
+            WHERE LOWER(a.patient) = LOWER(?)
+            ORDER BY a.time_slot
+        """
+        with timed("sqlite.fast_route_reservations"):
+            rows = get_db().execute(query, (user_name,)).fetchall()
+        if not rows:
+            return "You have no appointments booked at the moment."
+        return format_slots("YOUR APPOINTMENTS:\n", rows)
+    if intent == "doctors":
+        return get_all_doctors_list()
+    if intent == "slots":
+        return prefetch_slots_info(chat_history) + "\nTell me the Slot ID you would like to book."
+    return None
+
 # =============================================================================
 # WEBSOCKET CHAT (with automatic router)
 # =============================================================================
@@ -793,34 +1332,35 @@ def chat_socket(ws):
     username from a query parameter (e.g., /ws?username=John%20Doe).
     The frontend must pass the username when connecting.
     """
-    chat_history = []
-    sql_chat_history = []
+    # Bounded ring buffers: appending past CHAT_BUFFER drops the oldest message
+    chat_history = deque(maxlen=CHAT_BUFFER)
+    sql_chat_history = deque(maxlen=CHAT_BUFFER)
+    # Previous medical question, part of the semantic cache key
+    last_medical_msg = None
     cid = id(ws)
     active_connections[cid] = chat_history
     
     # Get username from query parameter
-    from urllib.parse import parse_qs
+    # Agent modules pull in LangChain/embeddings, so load them only when a chat opens
+    from src import initialize_llm, parse_results, initialize_sql_agent, generate_consultation_summary, search_medical_info_cached
     
     current_ws_user_name = USER_NAME  # Default fallback from config
     
     try:
-        # Parse query string to get username
-        query_string = ws.environ.get('QUERY_STRING', '')
-        query_params = parse_qs(query_string)
-        
-        # Get username from query params (e.g., ?username=John%20Doe)
-        username_param = query_params.get('username', [None])[0]
-        print("the username_param is",query_params.get('username', [None]))
+        # Parse query string to get username (e.g., ?username=John%20Doe)
+        query_params = dict(parse_qsl(ws.environ.get('QUERY_STRING', ''), max_num_fields=4))
+        username_param = query_params.get('username')
+        log.debug("the username_param is %s", username_param)
         if username_param:
             current_ws_user_name = username_param
-            print(f"WebSocket: Connected user: {current_ws_user_name}")
+            log.info("WebSocket: Connected user: %s", current_ws_user_name)
             sql_agent = initialize_sql_agent(current_ws_user_name, max_tokens=MAX_TOKENS, temp=T)
             agent = initialize_llm(current_ws_user_name, HOST, k=K, max_tokens=MAX_TOKENS, temp=T)
 
         else:
-            print("WebSocket: No username provided, using default")
+            log.warning("WebSocket: No username provided, using default")
     except Exception as e:
-        print(f"WebSocket error: {e}")
+        log.error("WebSocket error: %s", e)
     
     # Ensure chat history file exists for this user
     ensure_user_chat_history_exists(current_ws_user_name)
@@ -837,65 +1377,68 @@ def chat_socket(ws):
             save_chat_message("user", msg, current_ws_user_name)
 
             try:
+                # Plain lookups are answered from the database, no agent needed
+                fast_response = fast_route(msg, current_ws_user_name, chat_history)
+                
                 # Router by keywords
-                if should_use_summary_agent(msg):
+                if fast_response is not None:
+                    log.debug("Fast route hit")
+                    response = fast_response
+                    # Keep the SQL agent aware of what the user has been shown
+                    sql_chat_history.append({"role": "user", "content": msg})
+                    sql_chat_history.append({"role": "assistant", "content": response})
+                elif should_use_summary_agent(msg):
                     # Usa Summary Agent 
-                    response = generate_consultation_summary(summary_llm, current_ws_user_name)
+                    flush_chat_messages(current_ws_user_name)
+                    response = generate_consultation_summary(get_summary_llm(), current_ws_user_name)
                 # Usa SQL Agent 
                 elif should_use_sql_agent(msg):                    
-                    print("Routing to SQL Agent")
+                    log.debug("Routing to SQL Agent")
                     
                     # Se l'utente chiede "show slots" o "available"
-                    msg_lower = msg.lower()
-                    if any(kw in msg_lower for kw in ["slot", "available", "show", "see"]):
-                        # Estrai i medici menzionati nell'ultimo messaggio dell'assistente
-                        mentioned_doctors = extract_mentioned_doctors_from_history(chat_history)
-                        print(f"Doctors mentioned in last response: {mentioned_doctors}")
-                        
-                        if mentioned_doctors:
-                            # Mostra solo gli slot dei medici menzionati
-                            slots = get_slots_by_doctors(mentioned_doctors)
-                            
-                            if slots:
-                                doctors_str = ", ".join(mentioned_doctors)
-                                slots_info = f"AVAILABLE SLOTS FOR {doctors_str}:\n"
-                                for slot in slots:
-                                    slot_id, doctor, time_slot, spec = slot
-                                    slots_info += f"- Slot ID {slot_id}: {doctor} ({spec}) - {time_slot}\n"
-                            else:
-                                # Nessuno slot per quei medici, mostra tutti
-                                all_slots = get_slots_by_specialization(None)
-                                doctors_str = ", ".join(mentioned_doctors)
-                                if all_slots:
-                                    slots_info = f"No slots available for {doctors_str}. Here are ALL available slots:\n"
-                                    for slot in all_slots:
-                                        slot_id, doctor, time_slot, spec = slot
-                                        slots_info += f"- Slot ID {slot_id}: {doctor} ({spec}) - {time_slot}\n"
-                                else:
-                                    slots_info = "No appointment slots available at the moment."
-                        else:
-                            # Nessun medico menzionato, mostra tutti gli slot
-                            all_slots = get_slots_by_specialization(None)
-                            if all_slots:
-                                slots_info = "ALL AVAILABLE SLOTS:\n"
-                                for slot in all_slots:
-                                    slot_id, doctor, time_slot, spec = slot
-                                    slots_info += f"- Slot ID {slot_id}: {doctor} ({spec}) - {time_slot}\n"
-                            else:
-                                slots_info = "No appointment slots available at the moment."
+                    if _SLOT_LISTING_RE.search(msg):
+                        # Slot dei medici menzionati nell'ultimo messaggio dell'assistente
+                        slots_info = prefetch_slots_info(chat_history)
                         
                         context_prefix = f"[PRE-FETCHED SLOTS DATA - USE THIS EXACTLY, DO NOT QUERY AGAIN]:\n{slots_info}\n\nUser says: "
                         message_for_agent = context_prefix + msg
                         
                         sql_chat_history.append({"role": "user", "content": message_for_agent})
-                        if len(sql_chat_history) > CHAT_BUFFER:
-                            sql_chat_history[:] = sql_chat_history[-CHAT_BUFFER:]
                         
-                        sql_result = sql_agent.invoke({"messages": sql_chat_history})
-                        sql_chat_history, response = parse_results(sql_result)
+                        # Don't hold a pooled connection through the LLM call;
+                        # the agent's tools borrow their own
+                        close_db(None)
+                        with timed("llm.sql_agent"):
+                            sql_result = sql_agent.invoke({"messages": list(sql_chat_history)})
+                        sql_messages, response = parse_results(sql_result)
+                        sql_chat_history.clear()
+                        sql_chat_history.extend(sql_messages)
                         sql_chat_history.append({"role": "assistant", "content": response})
                 else:
                     # Usa LLM Agent per domande mediche
+                    _, doc_retriever = get_document_agent()
+
+                    # --- SEMANTIC CACHE ---
+                    # Una domanda simile gia' risposta a questo utente salta l'LLM.
+                    # La risposta dipende dalla conversazione: la chiave include la
+                    # domanda precedente, e i follow-up brevi ("ok", "tell me more")
+                    # a conversazione avviata non usano la cache
+                    semantic_cache, cache_vec = None, None
+                    previous_msg, last_medical_msg = last_medical_msg, msg
+                    is_short_follow_up = bool(chat_history) and len(msg.split()) < SEMANTIC_CACHE_MIN_WORDS
+                    if doc_retriever is not None and msg.strip() and not is_short_follow_up:
+                        semantic_cache = get_semantic_cache(current_ws_user_name, doc_retriever.vectorstore.embeddings)
+                        cache_key = f"{previous_msg}\n{msg}" if previous_msg else msg
+                        cache_vec = semantic_cache.embed(cache_key)
+                        cached_response = semantic_cache.lookup(cache_vec)
+                        if cached_response is not None:
+                            log.debug("Semantic cache hit")
+                            chat_history.append({"role": "user", "content": msg})
+                            chat_history.append({"role": "assistant", "content": cached_response})
+                            save_chat_message("bot", cached_response, current_ws_user_name)
+                            ws.send(cached_response)
+                            continue
+
                     # Recupera la lista completa dei medici dal database
                     doctors_list = get_all_doctors_list()
 
@@ -903,33 +1446,42 @@ def chat_socket(ws):
                     # Recupera informazioni mediche dalla knowledge base FAISS sui sintomi inseriti dall'utente
                     faiss_context = None
                     if doc_retriever is not None and msg.strip():
-                        faiss_context = search_medical_info(doc_retriever, msg)
+                        with timed("kb.search"):
+                            faiss_context = search_medical_info_cached(doc_retriever, msg)
 
                     # Costruisci il prompt arricchito
                     enhanced_msg = f"{msg}\n\n[SYSTEM - DOCTORS DATABASE]:\n{doctors_list}\n\n"
                     if faiss_context and 'No relevant' not in faiss_context:
                         enhanced_msg += f"[SYSTEM - MEDICAL KNOWLEDGE BASE]:\n{faiss_context}\n\n"
-                    print("the enhanced_msg",enhanced_msg)
                     enhanced_msg += "INSTRUCTIONS: Based on the user's symptoms, choose the most appropriate doctor from the list above and give him a hint base on the symptoms and medical knowledge base."
 
                     chat_history.append({"role": "user", "content": enhanced_msg})
-                    if len(chat_history) > CHAT_BUFFER:
-                        chat_history[:] = chat_history[-CHAT_BUFFER:]
 
-                    llm_result = agent.invoke({"messages": chat_history})
-                    chat_history, response = parse_results(llm_result)
+                    close_db(None)
+                    with timed("llm.medical_agent"):
+                        llm_result = agent.invoke({"messages": list(chat_history)})
+                    llm_messages, response = parse_results(llm_result)
+                    chat_history.clear()
+                    chat_history.extend(llm_messages)
                     chat_history.append({"role": "assistant", "content": response})
 
+                    if semantic_cache is not None:
+                        semantic_cache.add(cache_vec, response)
+
                 # Save bot response to file
                 save_chat_message("bot", response, current_ws_user_name)
                 ws.send(response)
 
             except Exception as e:
                 ws.send(f"Bot Error: {str(e)}")
+            finally:
+                # The socket keeps its app context for its whole lifetime;
+                # hand the pooled DB connection back between turns
+                close_db(None)
 
     finally:
         active_connections.pop(cid, None)
-        print("WebSocket disconnected")
+        log.info("WebSocket disconnected")
 
 
 # ======================================================
@@ -938,18 +1490,26 @@ def chat_socket(ws):
 @app.get("/history")
 @login_required
 def download_history():
-    print("GET /history called")
+    log.debug("GET /history called")
     current_user_name = g.current_user['full_name']
+    flush_chat_messages(current_user_name)
     path = os.path.join(CHAT_HISTORY_FOLDER, f"{current_user_name.lower()}.txt")
     if not os.path.exists(path):
         return jsonify({"error": "No history found"}), 404
 
-    return send_file(
+    # conditional=True answers If-None-Match/If-Modified-Since/Range from the
+    # file's stat, so repeat downloads of an unchanged history send no body.
+    # The body itself goes through wsgi.file_wrapper (sendfile under gunicorn)
+    # or X-Sendfile when USE_X_SENDFILE is enabled.
+    response = send_file(
         path,
         as_attachment=True,
         download_name=f"{current_user_name}_chat_history.txt",
-        mimetype="text/plain"
+        mimetype="text/plain",
+        conditional=True
     )
+    response.headers['Cache-Control'] = 'private, max-age=60'
+    return response
 
 
 
@@ -959,12 +1519,12 @@ def api_my_reservations():
     """
     API endpoint to get user's reservations as JSON.
     """
-    print("GET /api/my-reservations called")
+    log.debug("GET /api/my-reservations called")
     
     # Get the authenticated user's name
     current_user_name = g.current_user['full_name']
     
-    db = sqlite3.connect(DB_PATH)
+    db = get_db()
     cur = db.cursor()
     
     query = """
@@ -975,7 +1535,8 @@ def api_my_reservations():
         ORDER BY a.time_slot
     """
     
-    result = cur.execute(query, (current_user_name,))
+    with timed("sqlite.my_reservations"):
+        rows = cur.execute(query, (current_user_name,)).fetchall()
     reservations = [
         {
             'slot_id': r[0],
@@ -983,9 +1544,8 @@ def api_my_reservations():
             'time_slot': r[2],
             'specialization': r[3]
         }
-        for r in result.fetchall()
+        for r in rows
     ]
-    db.close()
     
     return jsonify({'reservations': reservations, 'user_name': current_user_name})
 
@@ -999,34 +1559,30 @@ def api_doctors():
     """
     API endpoint to get all doctors and their available slots as JSON.
     """
-    print("GET /api/doctors called")
+    log.debug("GET /api/doctors called")
     
-    db = sqlite3.connect(DB_PATH)
+    db = get_db()
     cur = db.cursor()
     
-    # Get all doctors
-    doctors_query = "SELECT name, specialization FROM doctors ORDER BY name"
-    doctors_result = cur.execute(doctors_query).fetchall()
+    # Get all doctors with their available slots in one query
+    # (LEFT JOIN keeps doctors that have no free slots)
+    query = """
+        SELECT d.name, d.specialization, a.id, a.time_slot
+        FROM doctors d
+        LEFT JOIN appointments a ON a.doctor = d.name AND a.patient IS NULL
+        ORDER BY d.name, a.time_slot
+    """
+    with timed("sqlite.api_doctors"):
+        rows = cur.execute(query).fetchall()
     
     doctors = []
-    for doc in doctors_result:
-        # Get available slots for each doctor
-        slots_query = """
-            SELECT id, time_slot 
-            FROM appointments 
-            WHERE doctor = ? AND patient IS NULL
-            ORDER BY time_slot
-        """
-        slots_result = cur.execute(slots_query, (doc[0],)).fetchall()
-        
+    for (name, specialization), group in groupby(rows, key=lambda r: (r[0], r[1])):
         doctors.append({
-            'name': doc[0],
-            'specialization': doc[1],
-            'slots': [{'id': s[0], 'time_slot': s[1]} for s in slots_result]
+            'name': name,
+            'specialization': specialization,
+            'slots': [{'id': r[2], 'time_slot': r[3]} for r in group if r[2] is not None]
         })
     
-    db.close()
-    
     return jsonify({'doctors': doctors, 'user_name': get_current_user_name()})
 
 
@@ -1036,29 +1592,17 @@ def api_chat_history():
     """
     API endpoint to get chat history as JSON.
     """
-    print("GET /api/chat-history called")
+    log.debug("GET /api/chat-history called")
     
     # Get the authenticated user's name
     current_user_name = g.current_user['full_name']
+    flush_chat_messages(current_user_name)
     
     path = os.path.join(CHAT_HISTORY_FOLDER, f"{current_user_name.lower()}.txt")
     
     messages = []
     if os.path.exists(path):
-        import re
-        with open(path, 'r', encoding='utf-8') as f:
-            content = f.read()
-            # Parse messages with format: [DD-MM-YYYY HH:MM:SS] role: message
-            pattern = r'\[(\d{2}-\d{2}-\d{4} \d{2}:\d{2}:\d{2})\] (user|bot): (.+?)(?=\n\[|\Z)'
-            matches = re.findall(pattern, content, re.DOTALL)
-            
-            for match in matches:
-                timestamp, role, text = match
-                messages.append({
-                    'timestamp': timestamp,
-                    'role': 'user' if role == 'user' else 'bot',
-                    'text': text.strip()
-                })
+        messages = read_chat_history_cached(path)
     
     return jsonify({'messages': messages, 'user_name': current_user_name})
 
@@ -1069,7 +1613,7 @@ def api_book_slot(slot_id):
     """
     API endpoint to book a slot from the doctors page.
     """
-    print(f"POST /api/book-slot/{slot_id} called")
+    log.debug("POST /api/book-slot/%s called", slot_id)
     
     # Get the authenticated user's name
     current_user_name = g.current_user['full_name']
@@ -1077,28 +1621,9 @@ def api_book_slot(slot_id):
     data = request.get_json() or {}
     patient = data.get('patient', current_user_name)
     
-    db = sqlite3.connect(DB_PATH)
-    cur = db.cursor()
-    
-    # Check if slot exists and is available
-    check_query = "SELECT id, patient FROM appointments WHERE id = ?"
-    result = cur.execute(check_query, (slot_id,)).fetchone()
-    print("slot_id,result", slot_id, result)
-    if not result:
-        db.close()
-        return jsonify({"error": "Slot not found"}), 404
-    
-    if result[1] is not None:
-        db.close()
-        return jsonify({"error": "Slot already booked"}), 400
-    
-    # Book the slot
-    update_query = "UPDATE appointments SET patient = ? WHERE id = ?"
-    cur.execute(update_query, (patient, slot_id))
-    db.commit()
-    db.close()
-    
-    return jsonify({"success": True, "message": "Appointment booked successfully"})
+    status, body = book_slot(get_db(), slot_id, patient)
+    log.debug("slot_id,status %s %s", slot_id, status)
+    return jsonify(body), status
 
 
 @app.post("/api/cancel-slot/<int:slot_id>")
@@ -1107,7 +1632,7 @@ def api_cancel_slot(slot_id):
     """
     API endpoint to cancel a reservation.
     """
-    print(f"POST /api/cancel-slot/{slot_id} called")
+    log.debug("POST /api/cancel-slot/%s called", slot_id)
     
     # Get the authenticated user's name
     current_user_name = g.current_user['full_name']
@@ -1115,38 +1640,9 @@ def api_cancel_slot(slot_id):
     data = request.get_json() or {}
     patient = data.get('patient', current_user_name)
     
-    db = sqlite3.connect(DB_PATH)
-    cur = db.cursor()
-    
-    # Check if slot exists and belongs to this patient
-    check_query = "SELECT id, patient, doctor, time_slot FROM appointments WHERE id = ?"
-    result = cur.execute(check_query, (slot_id,)).fetchone()
-    print("slot_id,result,patient", slot_id, result,patient)
-    if not result:
-        db.close()
-        return jsonify({"error": "Slot not found"}), 404
-    
-    if result[1] is None:
-        db.close()
-        return jsonify({"error": "Slot is not booked"}), 400
-    
-    if result[1].lower() != patient.lower():
-        db.close()
-        return jsonify({"error": "Cannot cancel another patient's reservation"}), 403
-    
-    doctor = result[2]
-    time_slot = result[3]
-    
-    # Cancel the reservation
-    update_query = "UPDATE appointments SET patient = NULL WHERE id = ?"
-    cur.execute(update_query, (slot_id,))
-    db.commit()
-    db.close()
-    
-    return jsonify({
-        "success": True, 
-        "message": f"Appointment with {doctor} for {time_slot} cancelled successfully"
-    })
+    status, body = cancel_slot(get_db(), slot_id, patient)
+    log.debug("slot_id,status,patient %s %s %s", slot_id, status, patient)
+    return jsonify(body), status
 
 
 # ======================================================
@@ -1159,11 +1655,15 @@ def upload_document():
     API endpoint to upload a document (image, PDF, etc.).
     Saves file and stores metadata in documents table.
     """
-    print("POST /api/upload-document called")
+    log.debug("POST /api/upload-document called")
     
     # Get the authenticated user's name
     current_user_name = g.current_user['full_name']
     
+    # Reject from the header before request.files parses (and spools) the body
+    if request.content_length and request.content_length > app.config['MAX_CONTENT_LENGTH']:
+        return jsonify({"error": "File too large. Maximum size is 2MB."}), 413
+    
     if 'file' not in request.files:
         return jsonify({"error": "No file provided"}), 400
     
@@ -1176,7 +1676,8 @@ def upload_document():
     if not allowed_file(file.filename):
         return jsonify({"error": f"File type not allowed. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"}), 400
     
-    # Check file size
+    # Check the file part's exact size (the Content-Length check above also
+    # counts multipart overhead); the part is already spooled, so this is cheap
     file.seek(0, 2)  # Seek to end
     file_size = file.tell()
     file.seek(0)  # Reset to beginning
@@ -1193,30 +1694,17 @@ def upload_document():
     file.save(file_path)
     
     # Store in database
-    db = sqlite3.connect(DB_PATH)
+    db = get_db()
     cur = db.cursor()
     
-    # Ensure documents table exists (in case DB was created before this feature)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS documents (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            patient_id TEXT,
-            patient_surname TEXT,
-            document_path TEXT,
-            upload_date TEXT,
-            description TEXT
-        )
-    """)
-    
     insert_query = """
         INSERT INTO documents (patient_id, patient_surname, document_path, upload_date, description)
         VALUES (?, ?, ?, ?, ?)
     """
     upload_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    cur.execute(insert_query, (current_user_name.lower(), current_user_name, file_path, upload_date, description))
+    with db:
+        cur.execute(insert_query, (current_user_name.lower(), current_user_name, file_path, upload_date, description))
     doc_id = cur.lastrowid
-    db.commit()
-    db.close()
     
     return jsonify({
         "success": True, 
@@ -1233,26 +1721,14 @@ def get_my_documents():
     """
     Returns list of documents uploaded by the current user.
     """
-    print("GET /api/my-documents called")
+    log.debug("GET /api/my-documents called")
     
     # Get the authenticated user's name
     current_user_name = g.current_user['full_name']
     
-    db = sqlite3.connect(DB_PATH)
+    db = get_db()
     cur = db.cursor()
     
-    # Ensure table exists
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS documents (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            patient_id TEXT,
-            patient_surname TEXT,
-            document_path TEXT,
-            upload_date TEXT,
-            description TEXT
-        )
-    """)
-    
     query = """
         SELECT id, patient_surname, document_path, upload_date, description
         FROM documents
@@ -1260,7 +1736,6 @@ def get_my_documents():
         ORDER BY upload_date DESC
     """
     result = cur.execute(query, (current_user_name,)).fetchall()
-    db.close()
     
     documents = [
         {
@@ -1283,8 +1758,9 @@ def analyze_lab_report_endpoint():
     API endpoint to analyze a laboratory report PDF.
     Uses the Document Agent to extract values and provide medical advice.
     """
-    print("POST /api/analyze-lab-report called")
+    log.debug("POST /api/analyze-lab-report called")
     
+    document_llm, doc_retriever = get_document_agent()
     if document_llm is None or doc_retriever is None:
         return jsonify({
             "success": False,
@@ -1303,25 +1779,46 @@ def analyze_lab_report_endpoint():
     if not file_path.lower().endswith('.pdf'):
         return jsonify({"error": "Only PDF files can be analyzed"}), 400
     
+    # Analyze the lab report using the Document Agent, off the request thread
+    log.debug("queueing lab report analysis for %s", g.current_user)
+    job_id = submit_lab_report_job(
+        g.current_user['user_id'], document_llm, doc_retriever, file_path, g.current_user['full_name']
+    )
+    
+    return jsonify({"success": True, "job_id": job_id}), 202
+
+
+@app.get("/api/lab-report-status/<job_id>")
+@login_required
+def lab_report_status(job_id):
+    """
+    Returns the state of a lab report analysis job.
+    While it runs: {"status": "pending"}; once finished the analysis (or
+    error) is returned and the job is forgotten.
+    """
+    with _lab_report_jobs_lock:
+        job = _lab_report_jobs.get(job_id)
+        if job is None or job['user_id'] != g.current_user['user_id']:
+            return jsonify({"error": "Job not found"}), 404
+        if not job['future'].done():
+            return jsonify({"success": True, "status": "pending"})
+        del _lab_report_jobs[job_id]
+    
     try:
-        # Analyze the lab report using the Document Agent
-        print("line 1315",g.current_user)
-        analysis_result = analyze_lab_report(document_llm, doc_retriever, file_path)
-        
-        # Save the analysis to chat history
-        
-        save_chat_message("bot", f"Lab Report Analysis:\n{analysis_result}",g.current_user['full_name'])
-        
-        return jsonify({
-            "success": True,
-            "analysis": analysis_result
-        })
+        analysis_result = job['future'].result()
     except Exception as e:
-        print(f"Error analyzing lab report: {str(e)}")
+        log.error("Error analyzing lab report: %s", e)
         return jsonify({
             "success": False,
+            "status": "error",
             "error": f"Error analyzing report: {str(e)}"
         }), 500
+    
+    return jsonify({
+        "success": True,
+        "status": "done",
+        "analysis": analysis_result
+    })
 
 
 @app.delete("/api/document/<int:doc_id>")
@@ -1329,9 +1826,9 @@ def delete_document(doc_id):
     """
     Deletes a document by ID (only if owned by current user).
     """
-    print(f"DELETE /api/document/{doc_id} called")
+    log.debug("DELETE /api/document/%s called", doc_id)
     
-    db = sqlite3.connect(DB_PATH)
+    db = get_db()
     cur = db.cursor()
     
     # Check ownership
@@ -1339,11 +1836,9 @@ def delete_document(doc_id):
     result = cur.execute(check_query, (doc_id,)).fetchone()
     
     if not result:
-        db.close()
         return jsonify({"error": "Document not found"}), 404
     
     if result[1].lower() != USER_NAME.lower():
-        db.close()
         return jsonify({"error": "Not authorized"}), 403
     
     # Delete file from disk
@@ -1352,9 +1847,8 @@ def delete_document(doc_id):
         os.remove(file_path)
     
     # Delete from database
-    cur.execute("DELETE FROM documents WHERE id = ?", (doc_id,))
-    db.commit()
-    db.close()
+    with db:
+        cur.execute("DELETE FROM documents WHERE id = ?", (doc_id,))
     
     return jsonify({"success": True, "message": "Document deleted successfully"})
 
@@ -1363,26 +1857,19 @@ def delete_document(doc_id):
 # Database helpers
 # ======================================================
 def retrieve_appointment(slot_id: int):
-    with sqlite3.connect("assets/database/medassist.db") as db:
-        cur = db.cursor()
-        cur.execute(
-            "SELECT doctor, time_slot, patient FROM appointments WHERE id=?",
-            (slot_id,),
-        )
-        return cur.fetchone()
-
-def set_appointment(patient, slot_id: int):
-    with sqlite3.connect("assets/database/medassist.db") as db:
-        cur = db.cursor()
-        cur.execute("UPDATE appointments SET patient=? WHERE id=?", (patient, slot_id))
-        db.commit()
+    cur = get_db().cursor()
+    cur.execute(
+        "SELECT doctor, time_slot, patient FROM appointments WHERE id=?",
+        (slot_id,),
+    )
+    return cur.fetchone()
 
 # ======================================================
 # CRUD endpoints
 # ======================================================
 @app.get("/res")
 def get_reservation():
-    print("GET /res called")
+    log.debug("GET /res called")
     slot_id = request.args.get("id", type=int)
     if not slot_id:
         return jsonify({"error": "Missing slot_id"}), 400
@@ -1406,36 +1893,34 @@ def reserve():
     if not slot_id:
         return jsonify({"response": "Missing slot_id"}), 400
 
-    row = retrieve_appointment(slot_id)
-    if not row:
+    # Check-and-book in one conditional UPDATE (see src/appointments.py)
+    status, _ = book_slot(get_db(), slot_id, USER_NAME)
+    if status == 404:
         return jsonify({"response": "Unable to process request"}), 404
 
-    _, _, patient = row
-    if patient and patient.lower() != USER_NAME.lower():
-        return jsonify({"response": "Unable to process request"}), 403
-
-    if not patient:
-        set_appointment(USER_NAME, slot_id)
+    if status == 400:
+        # Already taken: still a success if it's this user's own reservation
+        row = retrieve_appointment(slot_id)
+        patient = row[2] if row else None
+        if not patient or patient.lower() != USER_NAME.lower():
+            return jsonify({"response": "Unable to process request"}), 403
 
     return jsonify({"response": "Reservation successful"})
 
 @app.post("/cancelReservation")
 def cancel():
-    print("POST /cancelReservation called")
+    log.debug("POST /cancelReservation called")
     data = request.get_json(silent=True) or {}
     slot_id = data.get("slot_id") or request.args.get("slot_id", type=int)
     if not slot_id:
         return jsonify({"response": "Missing slot_id"}), 400
 
-    row = retrieve_appointment(slot_id)
-    if not row:
-        return jsonify({"response": "Unable to process request"}), 404
-
-    _, _, patient = row
-    if patient and patient.lower() != USER_NAME.lower():
-        return jsonify({"response": "Unable to process request"}), 403
+    # Ownership check and cancellation in one conditional UPDATE; a slot
+    # that isn't booked (400) counts as already cancelled
+    status, _ = cancel_slot(get_db(), slot_id, USER_NAME)
+    if status in (403, 404):
+        return jsonify({"response": "Unable to process request"}), status
 
-    set_appointment(None, slot_id)
     return jsonify({"response": "Cancellation successful"})
 
 # ======================================================
@@ -1445,6 +1930,15 @@ def cancel():
 def health():
     return {"status": "ok"}
 
+@app.get("/metrics")
+def metrics():
+    """
+    Per-step latencies (SQLite, LLM, knowledge base) in Prometheus text format.
+    """
+    response = make_response(render_metrics())
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4'
+    return response
+
 # ======================================================
 # Run server
 # ======================================================
@@ -15,6 +15,7 @@ INDEX_ROOT = os.path.join(ASSETS_FOLDER, 'index')
 INDEX_NAME = 'medassist'
 INDEX_PATH = os.path.join(INDEX_ROOT, INDEX_NAME + '.faiss')
 CHAT_HISTORY_FOLDER = os.path.join(ASSETS_FOLDER, 'chat_history')
+SEMANTIC_CACHE_FOLDER = os.path.join(ASSETS_FOLDER, 'semantic_cache')
 
 # Parameters for creating vector index
 CHUNK_SIZE = 500
@@ -25,4 +26,20 @@ CHAT_BUFFER = 5 #number of previous messages to keep in context
 K = 4  # top k documents to retrieve (increased for better medical context)
 T = 0.1
 MAX_TOKENS = 500
+PROBLEM_MAX_TOKENS = 80  # the patient problem summary is cut to 200 chars anyway
 
+# Argon2id password hashing (OWASP parameters; keep a verify under ~250 ms)
+# Raising them upgrades stored hashes on each user's next login
+ARGON2_TIME_COST = 3
+ARGON2_MEMORY_COST = 64 * 1024  # KiB
+ARGON2_PARALLELISM = 2
+
+# Semantic response cache for the medical chat agent
+SEMANTIC_CACHE_THRESHOLD = 0.9  # minimum cosine similarity to reuse a response
+SEMANTIC_CACHE_MAX_ENTRIES = 1000  # per user
+SEMANTIC_CACHE_TTL = 24 * 3600  # seconds a cached response stays valid
+SEMANTIC_CACHE_MIN_WORDS = 4  # shorter follow-ups ("tell me more") skip the cache mid-conversation
+
+# Doctor roster caches (app snapshot and SQL agent tool): the roster rarely
+# changes, and both caches expire together so they never disagree for long
+DOCTOR_CACHE_TTL = 60  # seconds
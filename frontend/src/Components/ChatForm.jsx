@@ -1,6 +1,7 @@
 import { useRef, useEffect, useState } from "react"; // Modified import
 
 const API_BASE = `http://localhost:${import.meta.env.VITE_API_PORT || 8000}`;
+const LAB_REPORT_POLL_MS = 1000; // how often to check a running lab report analysis
 
 const ChatForm = ({
   setChatHistory,
@@ -47,7 +48,17 @@ const ChatForm = ({
             body: JSON.stringify({ file_path: pendingPdfPath }),
             credentials: 'include', // Include cookies/session
           });
-          const data = await response.json();
+          let data = await response.json();
+          // The analysis runs in the background: poll until the job finishes
+          if (response.status === 202 && data.job_id) {
+            while (data.status !== "done" && data.status !== "error" && !data.error) {
+              await new Promise((resolve) => setTimeout(resolve, LAB_REPORT_POLL_MS));
+              const statusResponse = await fetch(`${API_BASE}/api/lab-report-status/${data.job_id}`, {
+                credentials: 'include',
+              });
+              data = await statusResponse.json();
+            }
+          }
           setChatHistory((history) => {
             const newHistory = history.filter(msg => !msg.loading);
             return [
@@ -1,4 +1,28 @@
-from .helper import initialize_llm, parse_results
-from .sql_agent import initialize_sql_agent
-from .summary_agent import initialize_summary_agent, generate_consultation_summary, generate_patient_problem_summary
-from .document_agent import initialize_document_agent, analyze_lab_report
\ No newline at end of file
+# Agent modules import LangChain, Ollama and HuggingFace embeddings, which is slow.
+# Names are resolved on first access so that importing a lightweight submodule
+# (e.g. src.auth) does not pay that cost.
+import importlib
+
+_EXPORTS = {
+    'initialize_llm': '.helper',
+    'parse_results': '.helper',
+    'search_medical_info_cached': '.helper',
+    'initialize_sql_agent': '.sql_agent',
+    'initialize_summary_agent': '.summary_agent',
+    'generate_consultation_summary': '.summary_agent',
+    'generate_patient_problem_summary': '.summary_agent',
+    'initialize_document_agent': '.document_agent',
+    'analyze_lab_report': '.document_agent',
+}
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+__all__ = list(_EXPORTS)
@@ -0,0 +1,76 @@
+"""
+Booking and cancellation of appointment slots.
+Shared by the /api/book-slot and /api/cancel-slot endpoints and by the SQL
+agent's tools, which run in the same process and call these directly.
+"""
+
+import sqlite3
+
+from src.timing import timed
+
+
+def book_slot(db: sqlite3.Connection, slot_id: int, patient: str) -> tuple:
+    """
+    Book a free slot for a patient.
+
+    :param db: Open database connection.
+    :param slot_id: ID of the slot to book.
+    :param patient: Name of the patient booking.
+    :return: Tuple of (status, body): 200 with the booked doctor and time_slot,
+        404 if the slot doesn't exist, 400 if it is already booked.
+    """
+    # Book the slot only if it is still free; the WHERE clause makes the
+    # availability check and the update a single atomic statement
+    update_query = "UPDATE appointments SET patient = ? WHERE id = ? AND patient IS NULL RETURNING doctor, time_slot"
+    with timed("sqlite.book_slot"), db:
+        booked = db.execute(update_query, (patient, slot_id)).fetchone()
+
+    if booked is None:
+        # Nothing updated: tell a missing slot apart from a taken one
+        exists = db.execute("SELECT 1 FROM appointments WHERE id = ?", (slot_id,)).fetchone()
+        if not exists:
+            return 404, {"error": "Slot not found"}
+        return 400, {"error": "Slot already booked"}
+
+    doctor, time_slot = booked
+    return 200, {
+        "success": True,
+        "message": "Appointment booked successfully",
+        "doctor": doctor,
+        "time_slot": time_slot
+    }
+
+
+def cancel_slot(db: sqlite3.Connection, slot_id: int, patient: str) -> tuple:
+    """
+    Cancel a patient's reservation.
+
+    :param db: Open database connection.
+    :param slot_id: ID of the slot to cancel.
+    :param patient: Name of the patient canceling.
+    :return: Tuple of (status, body): 200 on success, 404 if the slot doesn't
+        exist, 400 if it isn't booked, 403 if it belongs to another patient.
+    """
+    # Cancel the reservation only if it belongs to this patient, in one statement
+    update_query = """
+        UPDATE appointments SET patient = NULL
+        WHERE id = ? AND LOWER(patient) = LOWER(?)
+        RETURNING doctor, time_slot
+    """
+    with timed("sqlite.cancel_slot"), db:
+        result = db.execute(update_query, (slot_id, patient)).fetchone()
+
+    if result is None:
+        # Nothing updated: work out why
+        existing = db.execute("SELECT patient FROM appointments WHERE id = ?", (slot_id,)).fetchone()
+        if not existing:
+            return 404, {"error": "Slot not found"}
+        if existing[0] is None:
+            return 400, {"error": "Slot is not booked"}
+        return 403, {"error": "Cannot cancel another patient's reservation"}
+
+    doctor, time_slot = result
+    return 200, {
+        "success": True,
+        "message": f"Appointment with {doctor} for {time_slot} cancelled successfully"
+    }
@@ -15,48 +15,59 @@ How it works:
 This is simpler than token-based auth because Flask handles cookie signing.
 """
 
+import os
 import re
+import logging
 import sqlite3
 import hashlib
 import secrets
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
 from flask import request, jsonify, g, session
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
 
-from config import DB_PATH
+from src.db_pool import get_conn
+from config import ARGON2_TIME_COST, ARGON2_MEMORY_COST, ARGON2_PARALLELISM
+
+log = logging.getLogger('healthassistant.auth')
 
 
 # =============================================================================
 # PASSWORD FUNCTIONS
 # =============================================================================
 
-def hash_password(password: str, salt: str = None) -> tuple:
+# Argon2id cost is set in config.py; check_needs_rehash() notices when it changes
+_password_hasher = PasswordHasher(
+    time_cost=ARGON2_TIME_COST,
+    memory_cost=ARGON2_MEMORY_COST,
+    parallelism=ARGON2_PARALLELISM,
+)
+
+# Hashes run on a small dedicated pool: the C code releases the GIL so
+# concurrent logins use separate cores, and at most this many 64 MiB
+# Argon2 buffers exist at once no matter how many requests arrive.
+PASSWORD_HASH_WORKERS = min(4, os.cpu_count() or 1)
+_password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash')
+
+
+def hash_password(password: str) -> tuple:
     """
-    Hash a password securely using PBKDF2-SHA256.
+    Hash a password securely using Argon2id.
     
-    Why PBKDF2?
-    - It's intentionally slow (100,000 iterations) to make brute-force attacks hard
-    - The salt prevents rainbow table attacks
+    Why Argon2id?
+    - It's memory-hard (64 MiB per hash by default), so GPU/ASIC brute force is expensive
+    - Its cost is tuned by memory and passes, giving a predictable login latency
+    - The salt is random per hash and stored inside the encoded hash
     
     Args:
         password: The plain text password
-        salt: Random string to add uniqueness (generated if not provided)
     
     Returns:
-        Tuple of (hashed_password, salt) - both as hex strings
+        Tuple of (encoded_hash, salt) - salt is empty because the encoded hash
+        already carries it; the column is kept for legacy PBKDF2 rows
     """
-    # Generate random salt if not provided
-    if salt is None:
-        salt = secrets.token_hex(32)
-    
-    # Hash password with salt using 100,000 iterations
-    hashed = hashlib.pbkdf2_hmac(
-        'sha256',           # Hash algorithm
-        password.encode(),  # Password as bytes
-        salt.encode(),      # Salt as bytes
-        100000              # Number of iterations (higher = slower = more secure)
-    )
-    
-    return hashed.hex(), salt
+    return _password_executor.submit(_password_hasher.hash, password).result(), ''
 
 
 def verify_password(password: str, stored_hash: str, salt: str) -> bool:
@@ -65,19 +76,55 @@ def verify_password(password: str, stored_hash: str, salt: str) -> bool:
     
     Args:
         password: The password to check
-        stored_hash: The hash stored in database
-        salt: The salt stored in database
+        stored_hash: The hash stored in database (Argon2 or legacy PBKDF2)
+        salt: The salt stored in database (only used by legacy hashes)
     
     Returns:
         True if password is correct, False otherwise
     """
-    # Hash the provided password with the same salt
-    computed_hash, _ = hash_password(password, salt)
+    if stored_hash.startswith('$argon2'):
+        try:
+            return _password_executor.submit(_password_hasher.verify, stored_hash, password).result()
+        except (VerificationError, InvalidHashError):
+            return False
     
+    # Legacy PBKDF2-SHA256 hash (100,000 iterations) from before Argon2id.
     # Compare using constant-time comparison (prevents timing attacks)
+    computed_hash = _password_executor.submit(
+        hashlib.pbkdf2_hmac, 'sha256', password.encode(), salt.encode(), 100000
+    ).result().hex()
     return secrets.compare_digest(computed_hash, stored_hash)
 
 
+# Computed in the background at import, so no login ever pays for building it
+# (a lazy first build would make one unknown-user login cost two hashes)
+_dummy_hash_future = _password_executor.submit(_password_hasher.hash, secrets.token_hex(16))
+
+
+def _dummy_hash() -> str:
+    """
+    A valid hash of a random password, verified against when the user
+    doesn't exist so that path costs as much as a wrong password.
+    """
+    return _dummy_hash_future.result()
+
+
+def password_needs_rehash(stored_hash: str) -> bool:
+    """
+    True if the stored hash is legacy PBKDF2 or uses outdated Argon2 parameters.
+    """
+    if not stored_hash.startswith('$argon2'):
+        return True
+    return _password_hasher.check_needs_rehash(stored_hash)
+
+
+_PW_UPPER_RE = re.compile(r'[A-Z]')
+_PW_LOWER_RE = re.compile(r'[a-z]')
+_PW_DIGIT_RE = re.compile(r'\d')
+_PW_SPECIAL_RE = re.compile(r'[!@#$%^&*(),.?":{}|<>]')
+_EMAIL_RE = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+
+
 def validate_password_strength(password: str) -> tuple:
     """
     Check if password meets security requirements.
@@ -95,16 +142,16 @@ def validate_password_strength(password: str) -> tuple:
     if len(password) < 8:
         return False, "Password must be at least 8 characters"
     
-    if not re.search(r'[A-Z]', password):
+    if not _PW_UPPER_RE.search(password):
         return False, "Password must contain an uppercase letter"
     
-    if not re.search(r'[a-z]', password):
+    if not _PW_LOWER_RE.search(password):
         return False, "Password must contain a lowercase letter"
     
-    if not re.search(r'\d', password):
+    if not _PW_DIGIT_RE.search(password):
         return False, "Password must contain a number"
     
-    if not re.search(r'[!@#$%^&*(),.?":{}|<>]', password):
+    if not _PW_SPECIAL_RE.search(password):
         return False, "Password must contain a special character"
     
     return True, None
@@ -112,8 +159,7 @@ def validate_password_strength(password: str) -> tuple:
 
 def validate_email(email: str) -> bool:
     """Check if email format is valid."""
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return re.match(pattern, email) is not None
+    return _EMAIL_RE.match(email) is not None
 
 
 # =============================================================================
@@ -155,38 +201,30 @@ def register_user(username: str, email: str, password: str, full_name: str,
     # Hash the password before storing
     password_hash, salt = hash_password(password)
     
-    # Connect to database
-    db = sqlite3.connect(DB_PATH)
-    cur = db.cursor()
-    
-    try:
-        # Check if username already exists
-        cur.execute("SELECT id FROM users WHERE LOWER(username) = LOWER(?)", (username,))
-        if cur.fetchone():
-            db.close()
-            return False, "Username already exists"
+    # Borrow a pooled database connection
+    with get_conn() as db:
+        cur = db.cursor()
         
-        # Check if email already exists
-        cur.execute("SELECT id FROM users WHERE LOWER(email) = LOWER(?)", (email,))
-        if cur.fetchone():
-            db.close()
-            return False, "Email already registered"
-        
-        # Insert new user
-        cur.execute("""
-            INSERT INTO users (username, email, password_hash, password_salt, role, full_name)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (username.lower(), email.lower(), password_hash, salt, role, full_name))
-        
-        user_id = cur.lastrowid
-        db.commit()
-        db.close()
-        
-        return True, user_id
-        
-    except sqlite3.IntegrityError as e:
-        db.close()
-        return False, f"Database error: {str(e)}"
+        try:
+            # Insert new user; the unique indexes on LOWER(username) and
+            # LOWER(email) reject duplicates atomically
+            with db:
+                user_id = cur.execute("""
+                    INSERT INTO users (username, email, password_hash, password_salt, role, full_name)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    RETURNING id
+                """, (username.lower(), email.lower(), password_hash, salt, role, full_name)).fetchone()[0]
+            
+            return True, user_id
+            
+        except sqlite3.IntegrityError as e:
+            # e.g. "UNIQUE constraint failed: index 'ux_users_username_lower'"
+            # or "UNIQUE constraint failed: users.email"
+            if 'username' in str(e):
+                return False, "Username already exists"
+            if 'email' in str(e):
+                return False, "Email already registered"
+            return False, f"Database error: {str(e)}"
 
 
 # =============================================================================
@@ -204,43 +242,43 @@ def login_user(username_or_email: str, password: str) -> tuple:
     Returns:
         Tuple of (success, error_message, user_info_dict)
     """
-    db = sqlite3.connect(DB_PATH)
-    cur = db.cursor()
-    
     # Find user by username OR email
     query = """
-        SELECT id, username, email, password_hash, password_salt, role, full_name
+        SELECT id AS user_id, username, email, password_hash, password_salt, role, full_name
         FROM users
         WHERE LOWER(username) = LOWER(?) OR LOWER(email) = LOWER(?)
     """
-    result = cur.execute(query, (username_or_email, username_or_email)).fetchone()
+    with get_conn() as db:
+        result = db.execute(query, (username_or_email, username_or_email)).fetchone()
     #it extract the user info from the database if the username or email matches
-    # User not found
+    # User not found: still pay for a hash verification, otherwise the fast
+    # response would reveal which usernames/emails exist
     if not result:
-        db.close()
+        verify_password(password, _dummy_hash(), '')
         return False, "Invalid username or password", None
     
-    user_id, username, email, stored_hash, salt, role, full_name = result
+    user_id, stored_hash, salt = result['user_id'], result['password_hash'], result['password_salt']
     
     # Wrong password
     if not verify_password(password, stored_hash, salt):#it checks if the password is correct
-        db.close()
         return False, "Invalid username or password", None
     
-    db.close()
+    # Upgrade legacy PBKDF2 hashes now that we know the plain text password
+    if password_needs_rehash(stored_hash):
+        new_hash, new_salt = hash_password(password)
+        with get_conn() as db, db:
+            db.execute(
+                "UPDATE users SET password_hash = ?, password_salt = ? WHERE id = ?",
+                (new_hash, new_salt, user_id)
+            )
+        log.info("Upgraded password hash for user %s", user_id)
     
     # Store user_id in Flask session (this creates a signed cookie)
     session['user_id'] = user_id
     session.permanent = True  # Session lasts until browser closes or expires
     
     # Return user info
-    user_info = {
-        'user_id': user_id,
-        'username': username,
-        'email': email,
-        'role': role,
-        'full_name': full_name
-    }
+    user_info = {key: result[key] for key in ('user_id', 'username', 'email', 'role', 'full_name')}
     
     return True, None, user_info
 
@@ -250,6 +288,7 @@ def logout_user():
     Log out the current user by clearing the session.
     """
     session.clear()
+    g.pop('current_user', None)
 
 
 # =============================================================================
@@ -259,18 +298,28 @@ def logout_user():
 def get_current_user():
     """
     Get the currently logged-in user from the session cookie.
+    The user is loaded once per request and kept in g.current_user, so
+    stacked decorators and handlers don't query the database again.
     
     Returns:
         User info dict if logged in, None otherwise
     """
     # Check if user_id is in session
     user_id = session.get('user_id')
-    print("the user id is:",user_id)
+    log.debug("the user id is: %s", user_id)
     if not user_id:
         return None
     
+    # Already loaded during this request
+    user = g.get('current_user')
+    if user is not None and user['user_id'] == user_id:
+        return user
+    
     # Get user from database
-    return get_user_by_id(user_id)
+    user = get_user_by_id(user_id)
+    if user is not None:
+        g.current_user = user
+    return user
 
 
 def get_user_by_id(user_id: int) -> dict:
@@ -283,23 +332,11 @@ def get_user_by_id(user_id: int) -> dict:
     Returns:
         User info dict or None if not found
     """
-    db = sqlite3.connect(DB_PATH)
-    cur = db.cursor()
-    
-    query = "SELECT id, username, email, role, full_name FROM users WHERE id = ?"
-    result = cur.execute(query, (user_id,)).fetchone()
-    db.close()
-    
-    if not result:
-        return None
+    query = "SELECT id AS user_id, username, email, role, full_name FROM users WHERE id = ?"
+    with get_conn() as db:
+        result = db.execute(query, (user_id,)).fetchone()
     
-    return {
-        'user_id': result[0],
-        'username': result[1],
-        'email': result[2],
-        'role': result[3],
-        'full_name': result[4]
-    }
+    return dict(result) if result else None
 
 
 def get_doctor_for_user(user_id: int) -> dict:
@@ -312,20 +349,11 @@ def get_doctor_for_user(user_id: int) -> dict:
     Returns:
         Doctor info dict or None if user is not a doctor
     """
-    db = sqlite3.connect(DB_PATH)
-    cur = db.cursor()
-    
     query = "SELECT name, specialization FROM doctors WHERE user_id = ?"
-    result = cur.execute(query, (user_id,)).fetchone()
-    db.close()
+    with get_conn() as db:
+        result = db.execute(query, (user_id,)).fetchone()
     
-    if not result:
-        return None
-    
-    return {
-        'name': result[0],
-        'specialization': result[1]
-    }
+    return dict(result) if result else None
 
 
 # =============================================================================
@@ -346,12 +374,11 @@ def login_required(f):
     @wraps(f)#f is the function decorated
     def decorated_function(*args, **kwargs):
         user = get_current_user()
-        print("Current user in login_required:",user)
+        log.debug("Current user in login_required: %s", user)
         if not user:
             return jsonify({'error': 'Please log in first'}), 401
         
-        # Store user in Flask's g object for easy access in route
-        g.current_user = user
+        # get_current_user() stored the user in g.current_user for the route
         return f(*args, **kwargs)
     return decorated_function
 
@@ -376,7 +403,6 @@ def doctor_required(f):
         if user['role'] not in ['doctor', 'admin']:
             return jsonify({'error': 'Doctor access required'}), 403
         
-        g.current_user = user
         return f(*args, **kwargs)
     return decorated_function
 
@@ -394,6 +420,5 @@ def admin_required(f):
         if user['role'] != 'admin':
             return jsonify({'error': 'Admin access required'}), 403
         
-        g.current_user = user
         return f(*args, **kwargs)
     return decorated_function
@@ -19,6 +19,13 @@ CHAT_HISTORY_FOLDER = os.path.join(ASSETS_FOLDER, 'chat_history')
 # Parameters for creating vector index
 CHUNK_SIZE = 500
 CHUNK_OVERLAP = 20
+EMBED_BATCH_SIZE = 256
+INDEX_BATCH_SIZE = 1024  # chunks embedded and added to the index per step
+QUANTIZE_INDEX = True  # store vectors as int8 (4x smaller, faster scans)
+HNSW_INDEX = True  # graph index: ~log(N) search instead of scanning every vector
+HNSW_M = 32  # graph neighbours per vector
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64  # candidates explored per query (saved with the index)
 
 # Parameters for LLM initialization
 CHAT_BUFFER = 5
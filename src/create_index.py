@@ -1,9 +1,14 @@
 import os
+import glob
+import itertools
+import faiss
+import numpy as np
 from langchain_community.vectorstores import FAISS
-from langchain_community.document_loaders import DirectoryLoader, UnstructuredXMLLoader, CSVLoader, TextLoader
-import nltk
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.document_loaders import CSVLoader, TextLoader
+from langchain_text_splitters import RecursiveCharacterTextSplitter
 
-from helper import load_data, text_split, load_hf_embeddings
+from helper import load_data, iter_data, text_split, load_hf_embeddings, iter_files_parallel
 from config import *
 
 
@@ -12,66 +17,155 @@ MEDQUAD_PATH = os.path.join(ROOT_DIR, 'data', 'MedQuAD-master')
 MIMIC_PATH = os.path.join(ROOT_DIR, 'data', 'MIMIC-III/mimiciii-demo/demo')
 
 
-def fix_nltk():
-	# If you get error from nltk package, add the required downloads here
-	#nltk.download('all')
-	nltk.download('punkt_tab')
-	nltk.download('averaged_perceptron_tagger_eng')
+def _load_csv_file(path):
+	# Runs in a worker process: one CSV file -> its documents
+	return CSVLoader(path, encoding="utf-8").load()
 
 
-def load_mimic_data(mimic_path):
+def _load_txt_file(path):
+	# Runs in a worker process: one TXT file -> its documents
+	return TextLoader(path, encoding="utf-8").load()
+
+
+def iter_mimic_data(mimic_path):
 	"""
-	Load MIMIC-III data. Supports CSV and TXT files.
-	MIMIC-III typically contains CSV files with clinical notes.
+	Stream MIMIC-III documents (CSV, then TXT files), parsed in parallel
+	worker processes.
 	
 	:param mimic_path: Path to MIMIC-III data folder
-	:return: List of loaded documents
+	:return: Iterator over loaded documents
 	"""
-	all_docs = []
-	
 	# Load CSV files (e.g., NOTEEVENTS.csv, DIAGNOSES_ICD.csv)
 	if os.path.exists(mimic_path):
 		# Try loading CSV files
-		csv_pattern = "*.csv"
+		csv_files = sorted(glob.glob(os.path.join(mimic_path, "*.csv")))
+		count = 0
 		try:
-			csv_loader = DirectoryLoader(
-				mimic_path, 
-				glob=csv_pattern, 
-				show_progress=True, 
-				loader_cls=CSVLoader,
-				loader_kwargs={"encoding": "utf-8"}
-			)
-			csv_docs = csv_loader.load()
-			all_docs.extend(csv_docs)
-			print(f"Loaded {len(csv_docs)} documents from MIMIC-III CSV files")
+			for doc in iter_files_parallel(csv_files, _load_csv_file):
+				count += 1
+				yield doc
+			print(f"Loaded {count} documents from MIMIC-III CSV files")
 		except Exception as e:
 			print(f"Warning: Could not load CSV files from MIMIC-III: {e}")
 		
 		# Try loading TXT files (clinical notes)
-		txt_pattern = "**/*.txt"
+		txt_files = sorted(glob.glob(os.path.join(mimic_path, "**", "*.txt"), recursive=True))
+		count = 0
 		try:
-			txt_loader = DirectoryLoader(
-				mimic_path, 
-				glob=txt_pattern, 
-				show_progress=True, 
-				loader_cls=TextLoader,
-				loader_kwargs={"encoding": "utf-8"}
-			)
-			txt_docs = txt_loader.load()
-			all_docs.extend(txt_docs)
-			print(f"Loaded {len(txt_docs)} documents from MIMIC-III TXT files")
+			for doc in iter_files_parallel(txt_files, _load_txt_file):
+				count += 1
+				yield doc
+			print(f"Loaded {count} documents from MIMIC-III TXT files")
 		except Exception as e:
 			print(f"Warning: Could not load TXT files from MIMIC-III: {e}")
 	else:
 		print(f"Warning: MIMIC-III path not found: {mimic_path}")
 		print("To use MIMIC-III, download the data and place it in data/MIMIC-III/")
+
+
+def iter_medquad_data(medquad_path):
+	"""
+	Stream MedQuAD documents one XML file at a time.
+	
+	:param medquad_path: Path to MedQuAD data
+	:return: Iterator over loaded documents
+	"""
+	if not os.path.exists(medquad_path):
+		print(f"Warning: MedQuAD path not found: {medquad_path}")
+		return
+	count = 0
+	for doc in iter_data(medquad_path):
+		count += 1
+		yield doc
+	print(f"Loaded {count} documents from MedQuAD")
+
+
+def _batched(iterable, n):
+	# itertools.batched() is Python 3.12+
+	it = iter(iterable)
+	while batch := list(itertools.islice(it, n)):
+		yield batch
+
+
+def _new_vectorstore(embeddings, dim):
+	# Empty vectorstore over a flat L2 index, filled batch by batch with _index_batch()
+	return FAISS(embedding_function=embeddings, index=faiss.IndexFlatL2(dim), docstore=InMemoryDocstore(), index_to_docstore_id={})
+
+
+def _index_batch(vectorstore, chunks, vectors):
+	"""
+	Append a batch of chunks to a vectorstore with a single index.add() call.
+	
+	:param vectorstore: LangChain FAISS vectorstore
+	:param chunks: List of Document chunks
+	:param vectors: Contiguous (len(chunks), dim) float32 array of their embeddings
+	"""
+	start = vectorstore.index.ntotal
+	vectorstore.index.add(vectors)
+	ids = [str(start + i) for i in range(len(chunks))]
+	vectorstore.docstore.add(dict(zip(ids, chunks)))
+	vectorstore.index_to_docstore_id.update(zip(range(start, start + len(chunks)), ids))
+
+
+def quantize_index(vectorstore):
+	"""
+	Replace the flat FP32 index of a vectorstore with an 8-bit scalar-quantized one.
+	Each vector shrinks from 4 to 1 byte per dimension, so a search reads a
+	quarter of the memory. Vectors are re-added in the same order, so the
+	vectorstore's id -> document mapping stays valid.
 	
-	return all_docs
+	:param vectorstore: LangChain FAISS vectorstore built with a flat index
+	:return: The same vectorstore, now backed by an IndexScalarQuantizer
+	"""
+	flat_index = vectorstore.index
+	xb = flat_index.reconstruct_n(0, flat_index.ntotal)
+	sq_index = faiss.IndexScalarQuantizer(flat_index.d, faiss.ScalarQuantizer.QT_8bit, flat_index.metric_type)
+	sq_index.train(xb)
+	sq_index.add(xb)
+	vectorstore.index = sq_index
+	print(f"Quantized index to int8 ({flat_index.ntotal} vectors)")
+	return vectorstore
+
+
+def hnsw_index(vectorstore):
+	"""
+	Replace the flat index of a vectorstore with an HNSW graph, so a query
+	visits ~log(N) vectors instead of all of them. With QUANTIZE_INDEX the
+	graph stores int8 vectors (IndexHNSWSQ). Vectors are re-added in the
+	same order, so the vectorstore's id -> document mapping stays valid.
+	
+	:param vectorstore: LangChain FAISS vectorstore built with a flat index
+	:return: The same vectorstore, now backed by an HNSW index
+	"""
+	flat_index = vectorstore.index
+	xb = flat_index.reconstruct_n(0, flat_index.ntotal)
+	if QUANTIZE_INDEX:
+		index = faiss.IndexHNSWSQ(flat_index.d, faiss.ScalarQuantizer.QT_8bit, HNSW_M, flat_index.metric_type)
+		index.train(xb)
+	else:
+		index = faiss.IndexHNSWFlat(flat_index.d, HNSW_M, flat_index.metric_type)
+	index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+	index.add(xb)
+	index.hnsw.efSearch = HNSW_EF_SEARCH
+	vectorstore.index = index
+	print(f"Built HNSW index ({flat_index.ntotal} vectors, M={HNSW_M})")
+	return vectorstore
+
+
+def _compact_index(vectorstore):
+	# Swap the flat build-time index for the configured search index
+	if HNSW_INDEX:
+		hnsw_index(vectorstore)
+	elif QUANTIZE_INDEX:
+		quantize_index(vectorstore)
 
 
 def create_combined_index(medquad_path, mimic_path, save_path, chunk_size, chunk_overlap):
 	"""
 	Create a combined FAISS index from MedQuAD and MIMIC-III data.
+	Documents are streamed through splitting and embedding in batches of
+	INDEX_BATCH_SIZE chunks, so only one batch of text is held in memory
+	(plus the index itself) instead of the whole corpus.
 	
 	:param medquad_path: Path to MedQuAD data
 	:param mimic_path: Path to MIMIC-III data
@@ -81,41 +175,33 @@ def create_combined_index(medquad_path, mimic_path, save_path, chunk_size, chunk
 	:return: Combined vectorstore
 	"""
 	print("Creating combined index from MedQuAD + MIMIC-III...")
-	fix_nltk()
-	
-	all_documents = []
-	# Load MIMIC-III data
-	print("\n=== Loading MIMIC-III data ===")
-	mimic_data = load_mimic_data(mimic_path)
-	all_documents.extend(mimic_data)
 	
-	# Load MedQuAD data
-	print("\n=== Loading MedQuAD data ===")
-	if os.path.exists(medquad_path):
-		medquad_data = load_data(medquad_path)
-		all_documents.extend(medquad_data)
-		print(f"Loaded {len(medquad_data)} documents from MedQuAD")
-	else:
-		print(f"Warning: MedQuAD path not found: {medquad_path}")
+	# Load embeddings
+	print("\nLoading embeddings...")
+	embeddings = load_hf_embeddings(batch_size=EMBED_BATCH_SIZE)
 	
+	# MIMIC-III first, then MedQuAD, split document by document
+	splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+	documents = itertools.chain(iter_mimic_data(mimic_path), iter_medquad_data(medquad_path))
+	text_chunks = (chunk for doc in documents for chunk in splitter.split_documents([doc]))
 	
-	print(f"\n=== Total documents loaded: {len(all_documents)} ===")
+	# Embed and index each batch of chunks, then let it go
+	print("\n=== Loading, splitting and indexing documents ===")
+	vectorstore = None
+	total_chunks = 0
+	for batch in _batched(text_chunks, INDEX_BATCH_SIZE):
+		vectors = np.asarray(embeddings.embed_documents([c.page_content for c in batch]), dtype=np.float32)
+		if vectorstore is None:
+			vectorstore = _new_vectorstore(embeddings, vectors.shape[1])
+		_index_batch(vectorstore, batch, vectors)
+		total_chunks += len(batch)
+		print(f"Indexed {total_chunks} text chunks")
 	
-	if not all_documents:
+	if vectorstore is None:
 		raise ValueError("No documents loaded! Check your data paths.")
 	
-	# Split into chunks
-	print("\nSplitting documents into chunks...")
-	text_chunks = text_split(all_documents, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-	print(f"Created {len(text_chunks)} text chunks")
-	
-	# Load embeddings
-	print("\nLoading embeddings...")
-	embeddings = load_hf_embeddings()
-	
-	# Create vector store
-	print("\nCreating vector store...")
-	vectorstore = FAISS.from_documents(text_chunks, embedding=embeddings)
+	print(f"\n=== Total text chunks indexed: {total_chunks} ===")
+	_compact_index(vectorstore)
 	vectorstore.save_local(save_path)
 	
 	print(f"\n=== Index saved to {save_path} ===")
@@ -129,15 +215,17 @@ def create_index(data_path, save_path, chunk_size, chunk_overlap):
 	Kept for backward compatibility.
 	"""
 	print("Creating index...")
-	fix_nltk()
 	print("Loading data...")
 	data = load_data(data_path)
 	print("Data loaded...")
 	text_chunks = text_split(data, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
 	print("Loading embeddings...")
-	embeddings = load_hf_embeddings()
+	embeddings = load_hf_embeddings(batch_size=EMBED_BATCH_SIZE)
 	print("Creating vector store...")
-	vectorstore_from_docs = FAISS.from_documents(text_chunks, embedding=embeddings)
+	vectors = np.asarray(embeddings.embed_documents([c.page_content for c in text_chunks]), dtype=np.float32)
+	vectorstore_from_docs = _new_vectorstore(embeddings, vectors.shape[1])
+	_index_batch(vectorstore_from_docs, text_chunks, vectors)
+	_compact_index(vectorstore_from_docs)
 	vectorstore_from_docs.save_local(save_path)
 	print("Done!")
 	return vectorstore_from_docs
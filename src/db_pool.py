@@ -0,0 +1,139 @@
+"""
+Process-wide SQLite connection pool.
+Opening a connection costs several syscalls (the .db, -wal and -shm files)
+and starts with a cold page cache, so connections are opened once, tuned
+with the same PRAGMAs, and handed out to whichever thread needs one.
+"""
+
+import queue
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from config import DB_PATH
+
+log = logging.getLogger('healthassistant.db_pool')
+
+DB_POOL_SIZE = 8  # roughly the number of concurrent Flask worker threads
+DB_POOL_TIMEOUT = 5  # seconds to wait for a free connection before opening an extra one
+DB_MMAP_SIZE = 256 * 1024 * 1024  # bytes of the file read through mmap instead of read()
+
+
+class ConnectionPool:
+    """
+    A bounded pool of long-lived sqlite3 connections.
+    Connections are created on demand up to size; once all are in use,
+    acquire() waits for one to be released. If none frees up within
+    DB_POOL_TIMEOUT an extra connection is opened (and closed on release),
+    so a burst degrades to the old connect-per-call instead of deadlocking.
+    """
+
+    def __init__(self, db_path: str, size: int = DB_POOL_SIZE):
+        """
+        :param db_path: Path of the SQLite database file.
+        :param size: Maximum number of open connections.
+        """
+        self.db_path = db_path
+        self.size = size
+        self._idle = queue.LifoQueue()  # LIFO keeps the most recently used (warmest) connection busy
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connections move between threads, but only one thread holds each at a time
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA cache_size=-20000')
+        conn.execute(f'PRAGMA mmap_size={DB_MMAP_SIZE}')
+        conn.row_factory = sqlite3.Row  # rows index by name, still unpack like tuples
+        log.debug("Opened pooled connection (%d/%d)", self._created, self.size)
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """
+        Take a connection from the pool, opening a new one if the pool isn't full yet.
+        """
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_open = self._created < self.size
+            if can_open:
+                self._created += 1
+        if not can_open:
+            try:
+                return self._idle.get(timeout=DB_POOL_TIMEOUT)
+            except queue.Empty:
+                log.warning("Connection pool exhausted (%d in use), opening an extra connection", self.size)
+                return self._connect()
+        try:
+            return self._connect()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def release(self, conn: sqlite3.Connection):
+        """
+        Return a connection to the pool in a clean state: any open
+        transaction is rolled back and the sqlite3.Row factory restored.
+        """
+        if self._idle.qsize() >= self._created:
+            conn.close()  # an overflow connection
+            return
+        if conn.in_transaction:
+            conn.rollback()
+        conn.row_factory = sqlite3.Row
+        self._idle.put(conn)
+
+
+_pool = ConnectionPool(DB_PATH)
+
+
+def acquire_conn() -> sqlite3.Connection:
+    """
+    Take a connection from the shared pool; pair with release_conn().
+    """
+    return _pool.acquire()
+
+
+def release_conn(conn: sqlite3.Connection):
+    """
+    Give a connection taken with acquire_conn() back to the shared pool.
+    """
+    _pool.release(conn)
+
+
+@contextmanager
+def get_conn():
+    """
+    Borrow a pooled connection for the duration of a with block:
+
+        with get_conn() as db:
+            cur = db.cursor()
+            ...
+
+    Unlike `with sqlite3.connect(...)`, leaving the block does not commit;
+    use `with db:` inside it for writes.
+    """
+    conn = _pool.acquire()
+    try:
+        yield conn
+    finally:
+        _pool.release(conn)
+
+
+def like_contains(text: str) -> str:
+    """
+    Build a "contains" pattern for `LIKE ? ESCAPE '\\'` from user input, so
+    that '%' and '_' typed by the user match literally instead of as wildcards.
+
+    :param text: The substring to search for.
+    :return: The escaped pattern wrapped in '%'.
+    """
+    escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return '%' + escaped + '%'
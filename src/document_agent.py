@@ -5,13 +5,14 @@ Uses the medical knowledge base (FAISS) to provide advice on lab results.
 
 import os
 import re
+import logging
 from langchain_core.messages import SystemMessage, HumanMessage
-from langchain_ollama import ChatOllama
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface.embeddings import HuggingFaceEmbeddings
 
 from src.prompt import lab_report_analysis_prompt
-from config import INDEX_PATH, ASSETS_FOLDER
+from src.helper import search_medical_info_cached, retriever_settings, load_knowledge_base, get_chat_llm
+from src.timing import timed
+
+log = logging.getLogger('healthassistant.document_agent')
 
 # Try to import PDF extraction libraries
 try:
@@ -23,7 +24,7 @@ except ImportError:
         PDF_LIBRARY = "pypdf"
     except ImportError:
         PDF_LIBRARY = None
-        print("WARNING: No PDF library found. Install pymupdf or pypdf for PDF analysis.")
+        log.warning("No PDF library found. Install pymupdf or pypdf for PDF analysis.")
 
 
 def initialize_document_agent(max_tokens: int = 1024, temp: float = 0.1):
@@ -34,20 +35,16 @@ def initialize_document_agent(max_tokens: int = 1024, temp: float = 0.1):
     :param temp: Temperature for the LLM.
     :return: Tuple of (LLM, retriever) for document analysis.
     """
-    print("Initializing Document Agent...")
-    
-    # Load embeddings
-    os.environ['HF_HOME'] = os.path.join(ASSETS_FOLDER, '.hf_cache')
-    embeddings = HuggingFaceEmbeddings(model_name='sentence-transformers/all-MiniLM-L6-v2')
+    log.info("Initializing Document Agent...")
     
-    # Load FAISS index for medical knowledge
-    docsearch = FAISS.load_local(INDEX_PATH, embeddings, allow_dangerous_deserialization=True)
+    # Shared FAISS index for medical knowledge (loaded once with the chat agent)
+    docsearch = load_knowledge_base()
     retriever = docsearch.as_retriever(search_kwargs={"k": 3})
     
     # Load LLM
-    llm = ChatOllama(model="llama3.1", temperature=temp, max_tokens=max_tokens)
+    llm = get_chat_llm(temp, max_tokens)
     
-    print("Document Agent initialized!")
+    log.info("Document Agent initialized!")
     return llm, retriever
 
 
@@ -72,12 +69,8 @@ def extract_text_from_pdf(file_path: str) -> str:
 def _extract_with_pymupdf(file_path: str) -> str:
     """Extract text using PyMuPDF (fitz)."""
     try:
-        doc = fitz.open(file_path)
-        text = ""
-        for page in doc:
-            text += page.get_text()
-        doc.close()
-        return text
+        with fitz.open(file_path) as doc:
+            return "".join([page.get_text("text") for page in doc])
     except Exception as e:
         return f"Error extracting PDF: {str(e)}"
 
@@ -87,27 +80,32 @@ def _extract_with_pypdf(file_path: str) -> str:
     try:
         from pypdf import PdfReader
         reader = PdfReader(file_path)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() or ""
-        return text
+        return "".join([page.extract_text() or "" for page in reader.pages])
     except Exception as e:
         return f"Error extracting PDF: {str(e)}"
 
 
 
-def search_medical_info(retriever, query: str) -> str:
+LAB_REPORT_QUERY = "laboratory blood test results analysis interpretation abnormal values medical advice"
+
+# The query and the knowledge base never change, so the context for a given
+# retriever configuration is searched once and kept for the process lifetime
+_lab_report_context = {}  # retriever settings -> retrieved context
+
+
+def get_lab_report_context(retriever) -> str:
     """
-    Search medical information using the FAISS retriever.
+    Knowledge base context for lab report analysis, searched once per
+    retriever configuration.
     
-    :param retriever: The FAISS retriever.
-    :param query: Search query.
+    :param retriever: The FAISS retriever for medical information.
     :return: Retrieved medical information.
     """
-    docs = retriever.invoke(query)
-    if docs:
-        return "\n\n".join([doc.page_content for doc in docs])
-    return "No relevant medical information found."
+    key = retriever_settings(retriever)
+    context = _lab_report_context.get(key)
+    if context is None:
+        context = _lab_report_context[key] = search_medical_info_cached(retriever, LAB_REPORT_QUERY)
+    return context
 
 
 def analyze_lab_report(llm, retriever, file_path: str) -> str:
@@ -128,9 +126,9 @@ def analyze_lab_report(llm, retriever, file_path: str) -> str:
     if pdf_text.startswith("ERROR:"):
         return f"{pdf_text}"
     
-    # Single FAISS search for general lab report information (much faster)
-    query = "laboratory blood test results analysis interpretation abnormal values medical advice"
-    medical_context = search_medical_info(retriever, query)
+    # General lab report information from the knowledge base, searched only
+    # for the first report
+    medical_context = get_lab_report_context(retriever)
     
     # Create the prompt - let LLM handle all the interpretation
     system_message = SystemMessage(content=lab_report_analysis_prompt)
@@ -147,7 +145,8 @@ Please provide a clear analysis identifying any abnormal values and giving advic
     )
     
     try:
-        response = llm.invoke([system_message, user_message])
+        with timed("llm.lab_report"):
+            response = llm.invoke([system_message, user_message])
         return response.content
     except Exception as e:
         return f"Error analyzing document: {str(e)}"
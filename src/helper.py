@@ -1,70 +1,216 @@
 import os
+import logging
 import datetime
 from langchain_core.messages import SystemMessage, HumanMessage
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import DirectoryLoader, UnstructuredXMLLoader, CSVLoader
+from langchain_core.documents import Document
 from langchain_huggingface.embeddings import HuggingFaceEmbeddings
 from langchain_ollama import ChatOllama
 from langchain_community.vectorstores import FAISS
-from langchain_community.utilities import SQLDatabase
-from langchain_community.agent_toolkits import SQLDatabaseToolkit
-from langchain_core.tools.retriever import create_retriever_tool
 from langgraph.prebuilt import create_react_agent
 from langchain_core.tools import StructuredTool, ToolException
 import sqlite3
 import sys
 import os
+import time
+import glob
+import threading
+import functools
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree import ElementTree
 
 try:
     from src.prompt import prompt_template
+    from src.db_pool import get_conn, like_contains
+    from src.timing import timed
 except ModuleNotFoundError:
     from prompt import prompt_template
+    from db_pool import get_conn, like_contains
+    from timing import timed
 
 from config import *
 
+log = logging.getLogger('healthassistant.helper')
+
+
+def iter_files_parallel(paths, load_file):
+    """
+    Load files in a process pool, one file per task, yielding documents as
+    they are consumed. Only a window of files is in flight at a time, so a
+    slow consumer doesn't let every parsed file pile up in memory.
+
+    :param paths: List of file paths
+    :param load_file: Module-level function mapping a path to a list of documents
+    :return: Iterator over documents, in the order of paths
+    """
+    if not paths:
+        return
+    window = (os.cpu_count() or 1) * 8
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+        for start in range(0, len(paths), window):
+            for docs in ex.map(load_file, paths[start:start + window], chunksize=8):
+                yield from docs
+
+# MedQuAD elements whose text is indexed (the rest are ids/attributes)
+_MEDQUAD_TEXT_TAGS = frozenset(('Focus', 'Question', 'Answer'))
+
+def _load_medquad_file(path):
+    # Runs in a worker process: one MedQuAD XML file -> one Document with its
+    # focus and question/answer text, in document order
+    parts = []
+    try:
+        for _, elem in ElementTree.iterparse(path):
+            if elem.tag in _MEDQUAD_TEXT_TAGS and elem.text and elem.text.strip():
+                parts.append(elem.text.strip())
+            if elem.tag == 'QAPair':
+                elem.clear()
+    except ElementTree.ParseError as e:
+        log.warning("Skipping malformed XML %s: %s", path, e)
+        return []
+    if not parts:
+        return []
+    return [Document(page_content="\n\n".join(parts), metadata={'source': path})]
+
+def iter_data(data_path):
+    # Yields the MedQuAD documents, parsed in parallel worker processes
+    paths = sorted(glob.glob(os.path.join(data_path, '*', '*.xml')))
+    return iter_files_parallel(paths, _load_medquad_file)
 
 def load_data(data_path):
-    loader = DirectoryLoader(data_path, glob="*/*.xml", show_progress=True, loader_cls=UnstructuredXMLLoader)
-    data = loader.load()
-    return data
+    return list(iter_data(data_path))
 
 def text_split(data, chunk_size=500, chunk_overlap=20):
     splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
     text_chunks = splitter.split_documents(data)
     return text_chunks
 
-def load_hf_embeddings():
+def load_hf_embeddings(batch_size=32):
+    """
+    Load the MiniLM sentence embeddings, on the GPU when one is available.
+
+    :param batch_size: Number of texts per forward pass in embed_documents; raise it
+        for bulk indexing, the default suits single queries.
+    """
     os.environ['HF_HOME'] = os.path.join(ASSETS_FOLDER, '.hf_cache')
-    return HuggingFaceEmbeddings(model_name='sentence-transformers/all-MiniLM-L6-v2')
+    import torch
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    return HuggingFaceEmbeddings(
+        model_name='sentence-transformers/all-MiniLM-L6-v2',
+        model_kwargs={'device': device},
+        encode_kwargs={'batch_size': batch_size},
+    )
+
+@functools.lru_cache(maxsize=1)
+def load_knowledge_base():
+    """
+    Load the embeddings model and the FAISS knowledge base once per process.
+    Every chat connection and the document agent share the same vectorstore
+    instead of reloading the model and the index from disk.
+    """
+    log.info("Loading embeddings...")
+    embeddings = load_hf_embeddings()#it says how make embeddings from text using huggingface model
+    log.info("Loading index...")
+    return FAISS.load_local(INDEX_PATH, embeddings, allow_dangerous_deserialization=True)
+
+
+@functools.lru_cache(maxsize=8)
+def get_chat_llm(temp, max_tokens, stop=None):
+    """
+    Shared ChatOllama client for a (temperature, max_tokens, stop) combination.
+    The first client also starts loading the model in Ollama in the background.
+    
+    :param stop: Tuple of stop sequences (a tuple so it can be a cache key).
+    """
+    threading.Thread(target=_warm_up_model, args=("llama3.1",), daemon=True).start()
+    # num_predict is the option Ollama itself enforces as the output limit
+    return ChatOllama(model="llama3.1", temperature=temp, max_tokens=max_tokens,
+                      num_predict=max_tokens, stop=list(stop) if stop else None)
+
+
+@functools.lru_cache(maxsize=None)
+def _warm_up_model(model):
+    # A 1-token request makes Ollama load the weights, so the first real
+    # question doesn't wait for it. Cached: runs once per model and process.
+    try:
+        ChatOllama(model=model, num_predict=1).invoke("ok")
+        log.info("Warmed up %s", model)
+    except Exception as e:
+        log.warning("LLM warm-up failed: %s", e)
 
 def parse_results(result):
     return result['messages'], result['messages'][-1].content
 
 
+# --- Knowledge base search cache ---
+# The knowledge base is static, so a search for the same (normalized) query
+# returns the same chunks; repeated symptoms skip embedding + FAISS search.
+# Every retriever wraps the one load_knowledge_base() index, so entries are
+# keyed by the search settings (e.g. k) rather than the retriever object and
+# are shared by all chat connections and the document agent.
+MEDICAL_SEARCH_CACHE_SIZE = 512
+MEDICAL_SEARCH_CACHE_TTL = 300  # seconds
+_medical_search_cache = OrderedDict()  # (search settings, query) -> (timestamp, result)
+_medical_search_lock = threading.Lock()
+
+def retriever_settings(retriever) -> tuple:
+    """
+    Hashable description of what a retriever returns (search type and kwargs
+    such as k); retrievers over the shared index with equal settings are
+    interchangeable.
+    """
+    return (retriever.search_type, tuple(sorted(retriever.search_kwargs.items())))
+
+def search_medical_info_cached(retriever, query: str) -> str:
+    """
+    Search the medical knowledge base, with an LRU + TTL cache keyed by the
+    normalized (lowercased, whitespace-collapsed) query.
+
+    :param retriever: The FAISS retriever.
+    :param query: Search query.
+    :return: Retrieved chunks joined by blank lines, or a "No relevant" message.
+    """
+    key = (retriever_settings(retriever), " ".join(query.lower().split()))
+    now = time.monotonic()
+    with _medical_search_lock:
+        hit = _medical_search_cache.get(key)
+        if hit is not None and now - hit[0] < MEDICAL_SEARCH_CACHE_TTL:
+            _medical_search_cache.move_to_end(key)
+            return hit[1]
+
+    docs = retriever.invoke(query)
+    if docs:
+        result = "\n\n".join([doc.page_content for doc in docs])
+    else:
+        result = "No relevant medical information found."
+
+    with _medical_search_lock:
+        _medical_search_cache[key] = (now, result)
+        _medical_search_cache.move_to_end(key)
+        if len(_medical_search_cache) > MEDICAL_SEARCH_CACHE_SIZE:
+            _medical_search_cache.popitem(last=False)
+    return result
+
+
 def initialize_llm(user_name, host, k=2, max_tokens=512, temp=0.1):
-    # Load embeddings
-    print("Loading embeddings...")
-    embeddings = load_hf_embeddings()#it says how make embeddings from text using huggingface model
-    
-    # Load index
-    print("Loading index...")
-    docsearch = FAISS.load_local(INDEX_PATH, embeddings, allow_dangerous_deserialization=True)
+    # Load embeddings and index (once per process)
+    docsearch = load_knowledge_base()
     retriever = docsearch.as_retriever(search_kwargs={"k": k})
-    retriever_tool = create_retriever_tool(
-        retriever, 
+
+    def search_medical_information(query: str) -> str:
+        """Search the medical knowledge base for the query."""
+        return search_medical_info_cached(retriever, query)
+
+    retriever_tool = StructuredTool.from_function(
+        func=search_medical_information,
         name="search_medical_information", 
         description="MANDATORY: You MUST use this tool FIRST whenever the user mentions symptoms, health problems, medical conditions, or asks health-related questions. This retrieves accurate medical information from our knowledge base. ALWAYS call this before giving any medical advice. Never answer health questions without using this tool first."
     )
     tools = [retriever_tool]
     
     # Load LLM
-    print("Loading LLM...")
-    llm = ChatOllama(model="llama3.1", temperature=temp, max_tokens=max_tokens)
-    
-    # Load DB
-    db = SQLDatabase.from_uri("sqlite:///" + DB_PATH)
-    toolkit = SQLDatabaseToolkit(db=db, llm=llm)
-    #tools += toolkit.get_tools()
+    log.info("Loading LLM...")
+    llm = get_chat_llm(temp, max_tokens)
     
     # Create additional tools
     search_available_doctor_appointments_tool = StructuredTool.from_function(func=search_available_doctor_appointments, name="search_available_doctor_appointments", description="Use to look up available time slots for appointments with a specific doctor. Returns slots with doctor name, specialization, and slot ID.", handle_tool_error=True)
@@ -73,8 +219,8 @@ def initialize_llm(user_name, host, k=2, max_tokens=512, temp=0.1):
     tools += [retriever_tool, search_available_doctor_appointments_tool, get_all_available_slots_tool, search_patient_appointments_tool]
     
     # Create agent
-    print("Loading agent...")
-    prompt = SystemMessage(content=prompt_template.format(user_name=user_name, table_names=db.get_usable_table_names(), host=host))
+    log.info("Loading agent...")
+    prompt = SystemMessage(content=prompt_template.format(user_name=user_name))
     agent = create_react_agent(
         llm,
         tools,
@@ -82,7 +228,7 @@ def initialize_llm(user_name, host, k=2, max_tokens=512, temp=0.1):
     )
 
     
-    print("Done!")
+    log.info("Done!")
     
     return agent
 
@@ -95,23 +241,18 @@ def search_available_doctor_appointments(doctor: str) -> str:
     :return: A formatted string with available time slots grouped by doctor with specialization.
     """
     
-    # Open connection to DB
-    db = sqlite3.connect(DB_PATH)
-    cur = db.cursor()
-    
     # Prepare query to retrieve time slot information with JOIN for specialization
     query = """
                 SELECT a.id, a.time_slot, a.doctor, d.specialization
                 FROM appointments a
                 JOIN doctors d ON a.doctor = d.name
-                WHERE a.patient IS NULL AND LOWER(a.doctor) LIKE LOWER(?)
+                WHERE a.patient IS NULL AND a.doctor LIKE ? ESCAPE '\\'
                 ORDER BY a.doctor, a.time_slot
             """
     
-    # Execute query and fetch result
-    result = cur.execute(query, ('%' + doctor + '%',))
-    rows = result.fetchall()
-    db.close()
+    # Execute query on a pooled connection and fetch result
+    with timed("sqlite.doctor_appointments"), get_conn() as db:
+        rows = db.execute(query, (like_contains(doctor),)).fetchall()
     
     if not rows:
         return f"No available slots found for doctor '{doctor}'."
@@ -128,38 +269,30 @@ def get_all_available_slots_for_booking() -> str:
     
     :return: A formatted string with all available slots grouped by doctor.
     """
-    db = sqlite3.connect(DB_PATH)
-    cur = db.cursor()
-    
+    # One row per doctor with its slot lines already formatted; the inner
+    # ORDER BY feeds GROUP_CONCAT the slots in time order
     query = """
-        SELECT a.id, a.doctor, a.time_slot, d.specialization
-        FROM appointments a
-        JOIN doctors d ON a.doctor = d.name
-        WHERE a.patient IS NULL
-        ORDER BY d.specialization, a.doctor, a.time_slot
+        SELECT doctor, specialization, GROUP_CONCAT('  - Slot ID ' || id || ': ' || time_slot, CHAR(10))
+        FROM (
+            SELECT a.id, a.doctor, a.time_slot, d.specialization
+            FROM appointments a
+            JOIN doctors d ON a.doctor = d.name
+            WHERE a.patient IS NULL
+            ORDER BY d.specialization, a.doctor, a.time_slot
+        )
+        GROUP BY specialization, doctor
+        ORDER BY specialization, doctor
     """
     
-    result = cur.execute(query)
-    rows = result.fetchall()
-    db.close()
+    with timed("sqlite.slots_for_booking"), get_conn() as db:
+        rows = db.execute(query).fetchall()
     
     if not rows:
         return "No available appointment slots at the moment."
     
-    # Group by doctor
-    from collections import defaultdict
-    grouped = defaultdict(list)
-    for r in rows:
-        slot_id, doctor, time_slot, specialization = r
-        grouped[(doctor, specialization)].append((slot_id, time_slot))
-    
     # Format output
     output_lines = ["ALL AVAILABLE APPOINTMENT SLOTS (grouped by doctor):"]
-    for (doctor, specialization), slots in grouped.items():
-        output_lines.append(f"\n**{doctor}** ({specialization}):")
-        for slot_id, time_slot in slots:
-            output_lines.append(f"  - Slot ID {slot_id}: {time_slot}")
-    
+    output_lines.extend(f"\n**{doctor}** ({specialization}):\n{slot_lines}" for doctor, specialization, slot_lines in rows)
     output_lines.append("\nTo book, the user should use the appointment management system with the desired slot ID.")
     return "\n".join(output_lines)
 
@@ -174,28 +307,26 @@ def search_patient_appointments(patient: str, doctor: str = None) -> list[dict]:
     """
     
     
-    # Open connection to DB
-    db = sqlite3.connect(DB_PATH)
-    cur = db.cursor()
-    
     if doctor is not None and doctor != '':
         # Prepare query to retrieve time slot information
         query = """
                     SELECT id, time_slot, doctor
                     FROM appointments
-                    WHERE LOWER(patient) LIKE LOWER(?) and LOWER(doctor) LIKE LOWER(?)
+                    WHERE LOWER(patient) = LOWER(?) and doctor LIKE ? ESCAPE '\\'
                 """
-    
-        # Execute query and fetch result
-        result = cur.execute(query, ('%' + patient + '%', '%' + doctor + '%',))
+        params = (patient, like_contains(doctor),)
     else:
         # Prepare query to retrieve time slot information
         query = """
                     SELECT id, time_slot, doctor
                     FROM appointments
-                    WHERE LOWER(patient) LIKE LOWER(?)
+                    WHERE LOWER(patient) = LOWER(?)
                 """
-        # Execute query and fetch result
-        result = cur.execute(query, ('%' + patient + '%',))
+        params = (patient,)
+    
+    # Patients are matched by full name (case-insensitive) so the lookup uses
+    # the LOWER(patient) index instead of scanning every appointment
+    with timed("sqlite.patient_appointments"), get_conn() as db:
+        rows = db.execute(query, params).fetchall()
     
-    return list(({'time_slot': r[1],'doctor': r[2],  'reservation_link': '<a href="res?id={}" target="_blank"> link </a>'.format(r[0])} for r in result.fetchall()))
+    return [{'time_slot': r['time_slot'], 'doctor': r['doctor'], 'reservation_link': '<a href="res?id={}" target="_blank"> link </a>'.format(r['id'])} for r in rows]
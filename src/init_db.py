@@ -1,45 +1,95 @@
 #!/usr/bin/env python3
 """
 Standalone database initialization script.
-Run this to create/reset the database with users and authentication.
+Run this to create the database with users and authentication. Re-running it
+only adds the seed rows that are missing; pass --reset to back up the current
+database and start from scratch.
 """
 
 import os
+import sys
+import argparse
 import shutil
 import sqlite3
-import hashlib
-import secrets
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+from argon2 import PasswordHasher
+
+# The Argon2 costs must be the ones the app verifies against, so they come from
+# the root config.py even when this script is run as `python src/init_db.py`
+# (where a plain `import config` would find src/config.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from config import ARGON2_TIME_COST, ARGON2_MEMORY_COST, ARGON2_PARALLELISM
+
 # Database path
 DB_PATH = os.path.join(os.path.dirname(__file__), '../assets', 'database', 'medassist.db')
 
 
-def hash_password(password, salt=None):
-    if salt is None:
-        salt = secrets.token_hex(32)
-    hashed = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), 100000)
-    return hashed.hex(), salt
+# Same Argon2id parameters as src/auth.py (ARGON2_* in the root config.py);
+# the salt lives inside the encoded hash.
+# FAST_SEED_HASH=1 seeds throwaway (test/CI) databases with a low-cost profile;
+# auth.py sees the outdated parameters and rehashes each password on first login.
+if os.environ.get('FAST_SEED_HASH', '').lower() in ('1', 'true', 'yes'):
+    _password_hasher = PasswordHasher(time_cost=1, memory_cost=8 * 1024, parallelism=1)
+else:
+    _password_hasher = PasswordHasher(
+        time_cost=ARGON2_TIME_COST,
+        memory_cost=ARGON2_MEMORY_COST,
+        parallelism=ARGON2_PARALLELISM,
+    )
+
+
+def hash_password(password):
+    return _password_hasher.hash(password), ''
+
 
+def init_database(reset=False):
+    """
+    Create the tables and insert the seed users, doctors and appointments.
+    Seed rows already in the database are skipped (no password hashing for
+    existing users), so re-running is cheap.
 
-def init_database():
+    :param reset: Move the existing database to <DB_PATH>.old and start empty.
+    """
     print("=== MedAssistant Database Initialization ===\n")
     
     # Backup existing
-    if os.path.exists(DB_PATH):
+    if reset and os.path.exists(DB_PATH):
+        # Committed rows may still live only in the -wal file (the app runs in
+        # WAL mode): fold them into the main file before moving it
+        old = sqlite3.connect(DB_PATH)
+        try:
+            busy, _, _ = old.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+        finally:
+            old.close()
+        if busy:
+            raise SystemExit('Database is in use (is the app running?); stop it before --reset')
         backup_path = DB_PATH + '.old'
-        shutil.move(DB_PATH, backup_path)
+        # Move any leftover -wal/-shm with it so they are never paired with the new database
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(DB_PATH + suffix):
+                shutil.move(DB_PATH + suffix, backup_path + suffix)
         print(f'Backed up existing database to {backup_path}')
 
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
+    # A new database is built in memory and written to disk in one sequential
+    # pass by VACUUM INTO; an existing one is topped up in place
+    fresh = not os.path.exists(DB_PATH)
+    conn = sqlite3.connect(':memory:' if fresh else DB_PATH)
+    # A one-shot bulk load: skip fsyncs while seeding;
+    # WAL is the mode the app's connection pool runs in anyway
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=OFF')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-20000')
     cur = conn.cursor()
 
     # Create tables
     cur.execute('''CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE NOT NULL,
-        email TEXT UNIQUE NOT NULL,
+        username TEXT NOT NULL,
+        email TEXT NOT NULL,
         password_hash TEXT NOT NULL,
         password_salt TEXT NOT NULL,
         role TEXT NOT NULL DEFAULT 'patient',
@@ -75,6 +125,9 @@ def init_database():
 
     print('Tables created successfully')
 
+    # All seed rows go in one explicit transaction, committed once below
+    conn.execute('BEGIN IMMEDIATE')
+
     # Insert users
     users = [
         ('rossi', 'mario.rossi@email.com', 'Password123!', 'patient', 'Mario Rossi'),
@@ -95,33 +148,49 @@ def init_database():
         ('admin', 'admin@medassist.com', 'AdminPass123!', 'admin', 'System Admin'),
     ]
 
-    for username, email, password, role, full_name in users:
-        pw_hash, salt = hash_password(password)
-        cur.execute(
-            'INSERT INTO users (username, email, password_hash, password_salt, role, full_name) VALUES (?, ?, ?, ?, ?, ?)',
-            (username, email, pw_hash, salt, role, full_name)
-        )
+    # Only hash and insert the users that aren't there yet
+    user_ids = dict(cur.execute('SELECT LOWER(username), id FROM users').fetchall())
+    new_users = [user for user in users if user[0] not in user_ids]
+
+    # Argon2 is the slow part of seeding; argon2-cffi releases the GIL while
+    # hashing, so a thread pool runs the hashes on all cores
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        hashes = list(executor.map(hash_password, [password for _, _, password, _, _ in new_users]))
+    user_rows = [
+        (username, email, pw_hash, salt, role, full_name)
+        for (username, email, _, role, full_name), (pw_hash, salt) in zip(new_users, hashes)
+    ]
+    if user_rows:
+        # RETURNING gives the new ids, so doctors are linked by username
+        # rather than by assuming the order rowids are handed out in
+        placeholders = ', '.join(['(?, ?, ?, ?, ?, ?)'] * len(user_rows))
+        user_ids.update(cur.execute(
+            f'INSERT INTO users (username, email, password_hash, password_salt, role, full_name) VALUES {placeholders} RETURNING username, id',
+            [value for row in user_rows for value in row]
+        ).fetchall())
 
-    print(f'Inserted {len(users)} users')
+    print(f'Inserted {len(new_users)} users ({len(users) - len(new_users)} already present)')
 
-    # Insert doctors with user_id
+    # Insert doctors linked to their user account
     doctors = [
-        ('Dr. Fontana', 'Neurology', 6),
-        ('Dr. Moretti', 'Neurology', 7),
-        ('Dr. Ricci', 'Pneumology', 8),
-        ('Dr. Colombo', 'Cardiology', 9),
-        ('Dr. Ferrari', 'Cardiology', 10),
-        ('Dr. Romano', 'Dermatology', 11),
-        ('Dr. Greco', 'Gastroenterology', 12),
-        ('Dr. Conti', 'Endocrinology', 13),
-        ('Dr. Mancini', 'Orthopedics', 14),
-        ('Dr. Barbieri', 'Ophthalmology', 15),
+        ('Dr. Fontana', 'Neurology', 'dr.fontana'),
+        ('Dr. Moretti', 'Neurology', 'dr.moretti'),
+        ('Dr. Ricci', 'Pneumology', 'dr.ricci'),
+        ('Dr. Colombo', 'Cardiology', 'dr.colombo'),
+        ('Dr. Ferrari', 'Cardiology', 'dr.ferrari'),
+        ('Dr. Romano', 'Dermatology', 'dr.romano'),
+        ('Dr. Greco', 'Gastroenterology', 'dr.greco'),
+        ('Dr. Conti', 'Endocrinology', 'dr.conti'),
+        ('Dr. Mancini', 'Orthopedics', 'dr.mancini'),
+        ('Dr. Barbieri', 'Ophthalmology', 'dr.barbieri'),
     ]
 
-    for name, spec, user_id in doctors:
-        cur.execute('INSERT INTO doctors (name, specialization, user_id) VALUES (?, ?, ?)', (name, spec, user_id))
+    cur.executemany(
+        'INSERT OR IGNORE INTO doctors (name, specialization, user_id) VALUES (?, ?, ?)',
+        [(name, specialization, user_ids[username]) for name, specialization, username in doctors]
+    )
 
-    print(f'Inserted {len(doctors)} doctors')
+    print(f'Inserted {cur.rowcount} doctors')
 
     # Insert appointments
     base_date = datetime.now() + timedelta(days=1)
@@ -131,49 +200,60 @@ def init_database():
         'Difficulty breathing during exercise',
         'Chest pain and palpitations',
     ]
+    # slot_id -> (patient, problem) for the demo bookings
+    prebooked = {
+        2: ('Rossi', sample_problems[0]),
+        8: ('Bianchi', sample_problems[1]),
+        15: ('Verdi', sample_problems[2]),
+    }
 
+    slot_rows = []
     slot_id = 0
     for doc_idx, (doc_name, _, _) in enumerate(doctors):
         for day_offset in range(3):
             actual_day = (doc_idx % 5) + (day_offset * 5)
             slot_date = base_date + timedelta(days=actual_day)
-            while slot_date.weekday() >= 5:
-                slot_date += timedelta(days=1)
+            if slot_date.weekday() >= 5:
+                slot_date += timedelta(days=7 - slot_date.weekday())  # weekend -> Monday
+            date_str = slot_date.strftime('%d-%m-%Y')
             day_hours = available_hours[day_offset::2]
             for hour in day_hours:
-                time_slot = slot_date.replace(hour=hour, minute=0, second=0)
-                time_str = time_slot.strftime('%d-%m-%Y %H:%M:%S')
-                patient = None
-                problem = None
-                if slot_id == 2:
-                    patient = 'Rossi'
-                    problem = sample_problems[0]
-                elif slot_id == 8:
-                    patient = 'Bianchi'
-                    problem = sample_problems[1]
-                elif slot_id == 15:
-                    patient = 'Verdi'
-                    problem = sample_problems[2]
-                cur.execute(
-                    'INSERT INTO appointments (id, doctor, time_slot, patient, patient_problem) VALUES (?, ?, ?, ?, ?)',
-                    (slot_id, doc_name, time_str, patient, problem)
-                )
+                time_str = f'{date_str} {hour:02d}:00:00'
+                patient, problem = prebooked.get(slot_id, (None, None))
+                slot_rows.append((slot_id, doc_name, time_str, patient, problem))
                 slot_id += 1
 
-    print(f'Inserted {slot_id} appointment slots')
+    # One multi-row INSERT: ~80 rows x 5 values stays far below SQLite's
+    # bound-parameter limit, and the statement is parsed and stepped once
+    placeholders = ', '.join(['(?, ?, ?, ?, ?)'] * len(slot_rows))
+    cur.execute(
+        f'INSERT OR IGNORE INTO appointments (id, doctor, time_slot, patient, patient_problem) VALUES {placeholders}',
+        [value for row in slot_rows for value in row]
+    )
+
+    print(f'Inserted {cur.rowcount} appointment slots')
+
+    # Uniqueness is enforced by indexes built once over the loaded rows rather
+    # than maintained row by row. They are the same case-insensitive indexes
+    # app.py ensures at startup, and are stricter than column UNIQUE.
+    cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS ux_users_username_lower ON users(LOWER(username))')
+    cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS ux_users_email_lower ON users(LOWER(email))')
 
     conn.commit()
+    if fresh:
+        conn.execute('VACUUM INTO ?', (DB_PATH,))
 
     # Verify
     print('\n--- Database Verification ---')
-    cur.execute('SELECT COUNT(*) FROM users')
-    print(f'Users: {cur.fetchone()[0]}')
-    cur.execute('SELECT COUNT(*) FROM doctors')
-    print(f'Doctors: {cur.fetchone()[0]}')
-    cur.execute('SELECT COUNT(*) FROM appointments')
-    print(f'Appointments: {cur.fetchone()[0]}')
-    cur.execute('SELECT COUNT(*) FROM appointments WHERE patient IS NOT NULL')
-    print(f'Pre-booked: {cur.fetchone()[0]}')
+    user_count, doctor_count, slot_count, booked_count = cur.execute('''SELECT
+        (SELECT COUNT(*) FROM users),
+        (SELECT COUNT(*) FROM doctors),
+        (SELECT COUNT(*) FROM appointments),
+        (SELECT COUNT(*) FROM appointments WHERE patient IS NOT NULL)''').fetchone()
+    print(f'Users: {user_count}')
+    print(f'Doctors: {doctor_count}')
+    print(f'Appointments: {slot_count}')
+    print(f'Pre-booked: {booked_count}')
 
     cur.execute('SELECT username, role, full_name FROM users ORDER BY role, username')
     print('\nRegistered Users:')
@@ -190,4 +270,6 @@ def init_database():
 
 
 if __name__ == '__main__':
-    init_database()
+    parser = argparse.ArgumentParser(description='Create the MedAssistant database and seed data.')
+    parser.add_argument('--reset', action='store_true', help='back up the existing database and recreate it from scratch')
+    init_database(reset=parser.parse_args().reset)
@@ -0,0 +1,131 @@
+"""
+Semantic response cache for the medical chat agent.
+Paraphrased questions ("headache and fever" / "I have a fever with a headache")
+map to nearby sentence embeddings, so a previous answer can be reused
+instead of invoking the LLM again.
+"""
+
+import os
+import json
+import time
+import threading
+
+import faiss
+import numpy as np
+
+
+class SemanticCache:
+    """
+    Maps user messages to responses by cosine similarity.
+    Vectors are L2-normalized and stored in a faiss.IndexFlatIP, so the
+    inner product returned by a search is the cosine similarity.
+    Entries expire ttl seconds after they were added.
+    """
+
+    def __init__(self, embeddings, threshold: float = 0.9, max_entries: int = 1000, ttl: float = 86400):
+        """
+        :param embeddings: LangChain embeddings object (must provide embed_query).
+        :param threshold: Minimum cosine similarity for a cache hit.
+        :param max_entries: Maximum number of cached responses (oldest dropped first).
+        :param ttl: Seconds a cached response stays valid.
+        """
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.index = None
+        self.responses = []
+        self.created = []  # wall-clock time each entry was added (persisted across restarts)
+        self._lock = threading.Lock()
+
+    def embed(self, text: str) -> np.ndarray:
+        """
+        Embed and L2-normalize a message.
+
+        :param text: The message to embed.
+        :return: A (1, dim) float32 array.
+        """
+        vec = np.asarray([self.embeddings.embed_query(text)], dtype='float32')
+        faiss.normalize_L2(vec)
+        return vec
+
+    def lookup(self, vec: np.ndarray):
+        """
+        Find the cached response closest to an embedded message.
+
+        :param vec: Vector returned by embed().
+        :return: The cached response, or None if nothing is similar enough.
+        """
+        with self._lock:
+            if self.index is None or self.index.ntotal == 0:
+                return None
+            scores, ids = self.index.search(vec, 1)
+            if ids[0][0] == -1 or scores[0][0] < self.threshold:
+                return None
+            if time.time() - self.created[ids[0][0]] > self.ttl:
+                return None
+            return self.responses[ids[0][0]]
+
+    def _drop_oldest(self, count: int):
+        # IndexFlat keeps insertion order, so the oldest entries are ids 0..count-1
+        self.index.remove_ids(np.arange(count, dtype='int64'))
+        del self.responses[:count]
+        del self.created[:count]
+
+    def add(self, vec: np.ndarray, response: str):
+        """
+        Store a response for an embedded message.
+
+        :param vec: Vector returned by embed().
+        :param response: The response to cache.
+        """
+        now = time.time()
+        with self._lock:
+            if self.index is None:
+                self.index = faiss.IndexFlatIP(vec.shape[1])
+            # Entries are in insertion order, so expired ones are a prefix
+            expired = 0
+            while expired < len(self.created) and now - self.created[expired] > self.ttl:
+                expired += 1
+            if expired:
+                self._drop_oldest(expired)
+            if self.index.ntotal >= self.max_entries:
+                self._drop_oldest(1)
+            self.index.add(vec)
+            self.responses.append(response)
+            self.created.append(now)
+
+    def save(self, path: str):
+        """
+        Persist the cache as <path>.faiss and <path>.json.
+
+        :param path: File path without extension.
+        """
+        with self._lock:
+            if self.index is None or self.index.ntotal == 0:
+                return
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            faiss.write_index(self.index, path + '.faiss')
+            with open(path + '.json', 'w', encoding='utf-8') as f:
+                json.dump({'responses': self.responses, 'created': self.created}, f)
+
+    def load(self, path: str):
+        """
+        Load a cache saved with save(), if present.
+
+        :param path: File path without extension.
+        """
+        if not (os.path.exists(path + '.faiss') and os.path.exists(path + '.json')):
+            return
+        index = faiss.read_index(path + '.faiss')
+        with open(path + '.json', 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            return  # saved without timestamps: can't tell what expired, start empty
+        responses, created = data.get('responses', []), data.get('created', [])
+        if not (index.ntotal == len(responses) == len(created)):
+            return  # inconsistent files: start empty
+        with self._lock:
+            self.index = index
+            self.responses = responses
+            self.created = created
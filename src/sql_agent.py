@@ -4,253 +4,188 @@ Permette agli utenti di aggiungere, cancellare e visualizzare prenotazioni
 interagendo direttamente con il database SQLite.
 """
 
-import sqlite3
-import requests
+import time
+import logging
 from datetime import datetime
 from langchain_core.messages import SystemMessage
 from langchain_core.tools import StructuredTool, ToolException
-from langchain_ollama import ChatOllama
 from langgraph.prebuilt import create_react_agent
 
 from src.prompt import sql_agent_prompt
-from config import DB_PATH, USER_NAME
-from flask import session,request
-# Backend API base URL
-API_BASE_URL = "http://localhost:8000"
+from src.db_pool import get_conn, like_contains
+from src.appointments import book_slot, cancel_slot
+from src.auth import get_current_user
+from src.helper import get_chat_llm
+from src.timing import timed
+from config import USER_NAME, DOCTOR_CACHE_TTL
 
+log = logging.getLogger('healthassistant.sql_agent')
 
-def get_all_available_slots() -> list[dict]:
+# Read tools are called again and again within a conversation. The doctors
+# list is kept for DOCTOR_CACHE_TTL seconds, the same as app.py's roster
+# snapshot; free slots are cached against the appointments_version counter
+# (bumped by triggers on every booking/cancellation, see app.py), so they
+# are never stale.
+_doctors_cache = None          # (expires_at, doctors)
+_available_slots_cache = None  # (appointments_version, slots_table)
+
+
+def format_table(rows: list, empty: str) -> str:
     """
-    Retrieve all available appointment slots.
+    Format query rows as a compact pipe-separated table for the LLM: one
+    header line with the column names, then one line per row. Much shorter
+    to tokenize than a list of dicts repeating every key on every row.
     
-    :return: List of available slots with id, doctor, and time.
+    :param rows: sqlite3.Row results of a query.
+    :param empty: Text to return when there are no rows.
+    :return: The table as a string.
     """
-    db = sqlite3.connect(DB_PATH)
-    cur = db.cursor()
+    if not rows:
+        return empty
+    lines = [" | ".join(rows[0].keys())]
+    lines.extend(" | ".join(map(str, row)) for row in rows)
+    return "\n".join(lines)
+
+
+def get_all_available_slots() -> str:
+    """
+    Retrieve all available appointment slots.
     
+    :return: Table of available slots with slot_id, doctor, time_slot and specialization.
+    """
     query = """
-        SELECT a.id, a.doctor, a.time_slot, d.specialization
+        SELECT a.id AS slot_id, a.doctor, a.time_slot, d.specialization
         FROM appointments a
         JOIN doctors d ON a.doctor = d.name
         WHERE a.patient IS NULL
         ORDER BY a.time_slot
     """
     
-    result = cur.execute(query)
-    slots = [
-        {
-            'slot_id': r[0],
-            'doctor': r[1],
-            'time_slot': r[2],
-            'specialization': r[3]
-        }
-        for r in result.fetchall()
-    ]
-    db.close()
+    global _available_slots_cache
+    with timed("sqlite.available_slots"), get_conn() as db:
+        version = db.execute("SELECT version FROM appointments_version WHERE id = 1").fetchone()[0]
+        cached = _available_slots_cache
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        slots = format_table(db.execute(query).fetchall(), "No available slots.")
+    _available_slots_cache = (version, slots)
     return slots
 
 
-def get_user_reservations(patient: str) -> list[dict]:
+def query_appointments(patient: str = None, doctor: str = None, specialization: str = None) -> str:
     """
-    Retrieve all reservations for a patient.
+    Look up appointment slots. Without a patient it returns free slots;
+    with one it returns that patient's reservations. Filters can be combined.
     
-    :param patient: Patient name.
-    :return: List of patient's reservations.
-    :raises ToolException: if user tries to access another patient's reservations.
+    :param patient: Patient name: return this patient's reservations instead of free slots.
+    :param doctor: Only slots of doctors whose name contains this text.
+    :param specialization: Only slots of doctors whose specialization contains this text.
+    :return: Table of slots with slot_id, doctor, time_slot and specialization.
     """
+    if not (patient or doctor or specialization):
+        return get_all_available_slots()
     
+    clauses, params = [], []
+    if patient:
+        clauses.append("LOWER(a.patient) = LOWER(?)")
+        params.append(patient)
+    else:
+        clauses.append("a.patient IS NULL")
+    if doctor:
+        clauses.append("a.doctor LIKE ? ESCAPE '\\'")
+        params.append(like_contains(doctor))
+    if specialization:
+        clauses.append("d.specialization LIKE ? ESCAPE '\\'")
+        params.append(like_contains(specialization))
     
-    db = sqlite3.connect(DB_PATH)
-    cur = db.cursor()
-    
-    query = """
-        SELECT a.id, a.doctor, a.time_slot, d.specialization
+    query = f"""
+        SELECT a.id AS slot_id, a.doctor, a.time_slot, d.specialization
         FROM appointments a
         JOIN doctors d ON a.doctor = d.name
-        WHERE LOWER(a.patient) = LOWER(?)
+        WHERE {' AND '.join(clauses)}
         ORDER BY a.time_slot
     """
     
-    result = cur.execute(query, (patient,))
-    reservations = [
-        {
-            'slot_id': r[0],
-            'doctor': r[1],
-            'time_slot': r[2],
-            'specialization': r[3]
-        }
-        for r in result.fetchall()
-    ]
-    db.close()
-    return reservations
+    with timed("sqlite.query_appointments"), get_conn() as db:
+        rows = db.execute(query, params).fetchall()
+    return format_table(rows, "No reservations found." if patient else "No available slots.")
 
 
 def book_appointment(slot_id: int, patient: str) -> str:
     """
-    Book an appointment for a patient via API.
+    Book an appointment for a patient.
+    Runs the same booking logic as /api/book-slot in-process, for the
+    logged-in user of the current chat connection.
     
     :param slot_id: ID of the slot to book.
     :param patient: Name of the patient booking.
     :return: Confirmation message or error.
     :raises ToolException: if user tries to book for others or slot is not available.
     """
+    if get_current_user() is None:
+        raise ToolException("Failed to book appointment: Authentication required")
     
-    try:
-        
-        response = requests.post(
-            f"{API_BASE_URL}/api/book-slot/{slot_id}",
-            json={"patient": patient},
-            timeout=10,          
-            cookies=request.cookies  
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            # Get appointment details from DB for confirmation message
-            db = sqlite3.connect(DB_PATH)
-            cur = db.cursor()
-            result = cur.execute(
-                "SELECT doctor, time_slot FROM appointments WHERE id = ?", 
-                (slot_id,)
-            ).fetchone()
-            db.close()
-            
-            if result:
-                doctor, time_slot = result
-                return f"✓ DATABASE UPDATED - BOOKING CONFIRMED: Appointment with {doctor} booked for {time_slot}. Slot ID: {slot_id}. The reservation has been saved to the database."
-            return f"✓ DATABASE UPDATED - BOOKING CONFIRMED: Slot ID: {slot_id} has been booked."
-        
-        elif response.status_code == 404:
-            raise ToolException(f"Slot with ID {slot_id} does not exist.")
-        elif response.status_code == 400:
-            raise ToolException(f"Slot with ID {slot_id} is already booked.")
-        else:
-            raise ToolException(f"Failed to book appointment: {response.json().get('error', 'Unknown error')}")
+    with get_conn() as db:
+        status, data = book_slot(db, slot_id, patient)
     
-    except requests.exceptions.RequestException as e:
-        raise ToolException(f"API request failed: {str(e)}")
+    if status == 200:
+        return f"✓ DATABASE UPDATED - BOOKING CONFIRMED: Appointment with {data['doctor']} booked for {data['time_slot']}. Slot ID: {slot_id}. The reservation has been saved to the database."
+    elif status == 404:
+        raise ToolException(f"Slot with ID {slot_id} does not exist.")
+    elif status == 400:
+        raise ToolException(f"Slot with ID {slot_id} is already booked.")
+    else:
+        raise ToolException(f"Failed to book appointment: {data.get('error', 'Unknown error')}")
 
 
 def cancel_appointment(slot_id: int, patient: str) -> str:
     """
-    Cancel an existing reservation via API.
+    Cancel an existing reservation.
+    Runs the same cancellation logic as /api/cancel-slot in-process, for the
+    logged-in user of the current chat connection.
     
     :param slot_id: ID of the slot to cancel.
     :param patient: Name of the patient canceling.
     :return: Confirmation message or error.
     :raises ToolException: if user tries to cancel another patient's reservation.
     """
+    if get_current_user() is None:
+        raise ToolException("Failed to cancel appointment: Authentication required")
     
+    with get_conn() as db:
+        status, data = cancel_slot(db, slot_id, patient)
+    log.debug("cancel_slot status: %s", status)
     
-    try:
-        response = requests.post(
-            f"{API_BASE_URL}/api/cancel-slot/{slot_id}",
-            json={"patient": patient},
-            timeout=10,
-            cookies=request.cookies 
-        )
-        print(response.status_code,response.json())
-        if response.status_code == 200:
-            data = response.json()
-            message = data.get('message', f'Appointment cancelled successfully. Slot ID: {slot_id}')
-            return f"✓ DATABASE UPDATED - CANCELLATION CONFIRMED: {message}. The slot is now available for other patients."
-        
-        elif response.status_code == 404:
-            raise ToolException(f"Slot with ID {slot_id} does not exist.")
-        elif response.status_code == 400:
-            raise ToolException(f"Slot with ID {slot_id} has no reservation to cancel.")
-        elif response.status_code == 403:
-            raise ToolException(f"You cannot cancel this reservation. It belongs to another patient.")
-        else:
-            raise ToolException(f"Failed to cancel appointment: {response.json().get('error', 'Unknown error')}")
-    
-    except requests.exceptions.RequestException as e:
-        raise ToolException(f"API request failed: {str(e)}")
+    if status == 200:
+        return f"✓ DATABASE UPDATED - CANCELLATION CONFIRMED: {data['message']}. The slot is now available for other patients."
+    elif status == 404:
+        raise ToolException(f"Slot with ID {slot_id} does not exist.")
+    elif status == 400:
+        raise ToolException(f"Slot with ID {slot_id} has no reservation to cancel.")
+    elif status == 403:
+        raise ToolException(f"You cannot cancel this reservation. It belongs to another patient.")
+    else:
+        raise ToolException(f"Failed to cancel appointment: {data.get('error', 'Unknown error')}")
 
 
-def get_doctors_list() -> list[dict]:
+def get_doctors_list() -> str:
     """
     Retrieve the list of all available doctors.
     
-    :return: List of doctors with name and specialization.
+    :return: Table of doctors with name and specialization.
     """
-    db = sqlite3.connect(DB_PATH)
-    cur = db.cursor()
+    global _doctors_cache
+    cached = _doctors_cache
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
     
     query = "SELECT name, specialization FROM doctors ORDER BY specialization"
-    result = cur.execute(query)
-    doctors = [
-        {'name': r[0], 'specialization': r[1]}
-        for r in result.fetchall()
-    ]
-    db.close()
+    with timed("sqlite.doctors_list"), get_conn() as db:
+        doctors = format_table(db.execute(query).fetchall(), "No doctors found.")
+    _doctors_cache = (time.monotonic() + DOCTOR_CACHE_TTL, doctors)
     return doctors
 
 
-def get_slots_by_doctor(doctor: str) -> list[dict]:
-    """
-    Retrieve available slots for a specific doctor.
-    
-    :param doctor: Name of the doctor.
-    :return: Lista degli slot disponibili per quel dottore.
-    """
-    db = sqlite3.connect(DB_PATH)
-    cur = db.cursor()
-    
-    query = """
-        SELECT a.id, a.doctor, a.time_slot, d.specialization
-        FROM appointments a
-        JOIN doctors d ON a.doctor = d.name
-        WHERE a.patient IS NULL AND LOWER(a.doctor) LIKE LOWER(?)
-        ORDER BY a.time_slot
-    """
-    
-    result = cur.execute(query, ('%' + doctor + '%',))
-    slots = [
-        {
-            'slot_id': r[0],
-            'doctor': r[1],
-            'time_slot': r[2],
-            'specialization': r[3]
-        }
-        for r in result.fetchall()
-    ]
-    db.close()
-    return slots
-
-
-def get_slots_by_specialization(specialization: str) -> list[dict]:
-    """
-    Retrieve available slots for a specific specialization.
-    
-    :param specialization: specialization to filter by.
-    :return: List of available slots.
-    """
-    db = sqlite3.connect(DB_PATH)
-    cur = db.cursor()
-    
-    query = """
-        SELECT a.id, a.doctor, a.time_slot, d.specialization
-        FROM appointments a
-        JOIN doctors d ON a.doctor = d.name
-        WHERE a.patient IS NULL AND LOWER(d.specialization) LIKE LOWER(?)
-        ORDER BY a.time_slot
-    """
-    
-    result = cur.execute(query, ('%' + specialization + '%',))
-    slots = [
-        {
-            'slot_id': r[0],
-            'doctor': r[1],
-            'time_slot': r[2],
-            'specialization': r[3]
-        }
-        for r in result.fetchall()
-    ]
-    db.close()
-    return slots
-
-
 def initialize_sql_agent(user_name: str, max_tokens: int = 512, temp: float = 0.1):
     """
     Inizializza l'agente SQL per la gestione delle prenotazioni.
@@ -260,20 +195,14 @@ def initialize_sql_agent(user_name: str, max_tokens: int = 512, temp: float = 0.
     :param temp: Temperatura del modello LLM.
     :return: Agente LangChain configurato.
     """
-    print("Initializing SQL Agent...")
+    log.info("Initializing SQL Agent...")
     
     # Crea i tools
     tools = [
         StructuredTool.from_function(
-            func=get_all_available_slots,
-            name="get_all_available_slots",
-            description="Recupera tutti gli slot disponibili per prenotazioni. Usa questo tool quando l'utente vuole vedere tutti gli appuntamenti disponibili.",
-            handle_tool_error=True
-        ),
-        StructuredTool.from_function(
-            func=get_user_reservations,
-            name="get_user_reservations",
-            description="Recupera tutte le prenotazioni dell'utente. Usa questo tool quando l'utente vuole vedere le proprie prenotazioni. Richiede il nome del paziente.",
+            func=query_appointments,
+            name="query_appointments",
+            description="Recupera gli slot degli appuntamenti. Senza argomenti restituisce tutti gli slot disponibili; con doctor e/o specialization filtra gli slot disponibili per dottore o specializzazione; con patient restituisce le prenotazioni di quel paziente.",
             handle_tool_error=True
         ),
         StructuredTool.from_function(
@@ -294,22 +223,10 @@ def initialize_sql_agent(user_name: str, max_tokens: int = 512, temp: float = 0.
             description="Recupera la lista di tutti i dottori disponibili con le loro specializzazioni.",
             handle_tool_error=True
         ),
-        StructuredTool.from_function(
-            func=get_slots_by_doctor,
-            name="get_slots_by_doctor",
-            description="Recupera gli slot disponibili per un dottore specifico. Richiede il nome del dottore.",
-            handle_tool_error=True
-        ),
-        StructuredTool.from_function(
-            func=get_slots_by_specialization,
-            name="get_slots_by_specialization",
-            description="Recupera gli slot disponibili per una specializzazione specifica (es. Neurology, Cardiology).",
-            handle_tool_error=True
-        ),
     ]
     
     # Inizializza LLM
-    llm = ChatOllama(model="llama3.1", temperature=temp, max_tokens=max_tokens)
+    llm = get_chat_llm(temp, max_tokens)
     
     # Crea prompt di sistema
     prompt = SystemMessage(content=sql_agent_prompt.format(user_name=user_name))
@@ -317,5 +234,5 @@ def initialize_sql_agent(user_name: str, max_tokens: int = 512, temp: float = 0.
     # Crea agente
     agent = create_react_agent(llm, tools, prompt=prompt)
     
-    print("SQL Agent initialized!")
+    log.info("SQL Agent initialized!")
     return agent
@@ -3,12 +3,41 @@ Summary Agent for extracting structured consultation summaries from chat history
 """
 
 import os
-import sqlite3
+import re
+import time
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from langchain_core.messages import SystemMessage, HumanMessage
-from langchain_ollama import ChatOllama
 
+from src.db_pool import get_conn
 from src.prompt import summary_agent_prompt, patient_problem_prompt
-from config import CHAT_HISTORY_FOLDER, DB_PATH
+from src.helper import get_chat_llm
+from src.timing import timed
+from config import CHAT_HISTORY_FOLDER
+
+log = logging.getLogger('healthassistant.summary_agent')
+
+# The problem summary is requested before each booking, usually over a chat
+# history that hasn't changed since the last one. Results are keyed by the
+# user and a hash of the history, and dropped after 10 minutes.
+PROBLEM_CACHE_TTL = 600
+_problem_cache = {}  # (user_name, history_hash) -> (expires_at, problem)
+_chat_history_cache = {}  # filepath -> (mtime_ns, size, content)
+
+# The appointments query and the chat history read are independent, so the
+# query runs on this pool while the calling thread reads the file
+_fetch_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='summary-fetch')
+
+# Prompt size drives the LLM's prefill time. The problem summary only needs
+# the recent part of the chat, so it sees the last PROBLEM_MAX_TURNS messages
+# (at most PROBLEM_MAX_CHARS characters); the consultation summary keeps the
+# whole conversation. Both drop timestamps and redundant whitespace.
+PROBLEM_MAX_TURNS = 20
+PROBLEM_MAX_CHARS = 4000
+
+# Message header written by app.save_chat_message: "[dd-mm-yyyy HH:MM:SS] role: "
+_TURN_RE = re.compile(r'^\[\d{2}-\d{2}-\d{4} \d{2}:\d{2}:\d{2}\] (user|bot): ', re.MULTILINE)
 
 
 def get_user_appointments(user_name: str) -> str:
@@ -19,20 +48,18 @@ def get_user_appointments(user_name: str) -> str:
     :return: Formatted string with appointments or "None" if no appointments.
     """
     try:
-        db = sqlite3.connect(DB_PATH)
-        cur = db.cursor()
-        
         query = """
             SELECT a.time_slot, a.doctor, d.specialization
             FROM appointments a
             JOIN doctors d ON a.doctor = d.name
-            WHERE LOWER(a.patient) LIKE LOWER(?)
+            WHERE LOWER(a.patient) = LOWER(?)
             ORDER BY a.time_slot
         """
         
-        result = cur.execute(query, ('%' + user_name + '%',))
-        rows = result.fetchall()
-        db.close()
+        # Exact (case-insensitive) match: served by the LOWER(patient) index
+        # and never picks up another patient whose name contains this one
+        with timed("sqlite.get_user_appointments"), get_conn() as db:
+            rows = db.execute(query, (user_name,)).fetchall()
         
         if not rows:
             return "None"
@@ -44,23 +71,24 @@ def get_user_appointments(user_name: str) -> str:
         
         return "; ".join(appointments)
     except Exception as e:
-        print(f"Error fetching appointments: {e}")
+        log.error("Error fetching appointments: %s", e)
         return "Unable to retrieve"
 
 
-def initialize_summary_agent(max_tokens: int = 512, temp: float = 0.1):
+def initialize_summary_agent(max_tokens: int = 512, temp: float = 0.1, stop: tuple = None):
     """
     Initialize the Summary Agent for consultation summaries.
     
     :param max_tokens: Maximum tokens for the response.
     :param temp: Temperature for the LLM.
+    :param stop: Optional stop sequences, e.g. ("\n\n",) for one-paragraph answers.
     :return: Configured LLM for summaries.
     """
-    print("Initializing Summary Agent...")
+    log.info("Initializing Summary Agent...")
     
-    llm = ChatOllama(model="llama3.1", temperature=temp, max_tokens=max_tokens)
+    llm = get_chat_llm(temp, max_tokens, stop)
     
-    print("Summary Agent initialized!")
+    log.info("Summary Agent initialized!")
     return llm
 
 
@@ -74,15 +102,53 @@ def read_chat_history_from_file(user_name: str) -> str:
     filename = f"{user_name.lower()}.txt"
     filepath = os.path.join(CHAT_HISTORY_FOLDER, filename)
     
-    if not os.path.exists(filepath):
+    try:
+        st = os.stat(filepath)
+    except FileNotFoundError:
         return ""
     
+    # Both summaries read the same file back-to-back; reuse the contents
+    # while its mtime and size are unchanged
+    cached = _chat_history_cache.get(filepath)
+    if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+    
     try:
         with open(filepath, 'r', encoding='utf-8') as f:
-            return f.read()
+            content = f.read()
     except Exception as e:
-        print(f"Error reading chat history file: {e}")
+        log.error("Error reading chat history file: %s", e)
         return ""
+    _chat_history_cache[filepath] = (st.st_mtime_ns, st.st_size, content)
+    return content
+
+
+def _compact(text: str, max_turns: int = PROBLEM_MAX_TURNS, max_chars: int = PROBLEM_MAX_CHARS) -> str:
+    """
+    Shrink a chat history file's content for use in a prompt.
+    
+    :param text: Raw chat history file content.
+    :param max_turns: Keep only the last max_turns messages (all if None).
+    :param max_chars: Drop the oldest messages until the result fits (no limit if None).
+    :return: One "role: text" line per message, whitespace collapsed.
+    """
+    # split() gives [text before the first header, role, body, role, body, ...]
+    parts = _TURN_RE.split(text)
+    turns = [f"{role}: {' '.join(body.split())}" for role, body in zip(parts[1::2], parts[2::2]) if body.strip()]
+    if not turns:
+        turns = [' '.join(text.split())]
+    if max_turns:
+        turns = turns[-max_turns:]
+    if max_chars:
+        kept, total = [], 0
+        for turn in reversed(turns):
+            total += len(turn) + 1
+            if total > max_chars:
+                break
+            kept.append(turn)
+        # A single message longer than the limit keeps its end
+        turns = kept[::-1] if kept else [turns[-1][-max_chars:]]
+    return "\n".join(turns)
 
 
 def generate_consultation_summary(llm, user_name: str) -> str:
@@ -93,14 +159,14 @@ def generate_consultation_summary(llm, user_name: str) -> str:
     :param user_name: The user's name to find their chat history file.
     :return: Formatted consultation summary.
     """
-    # Read conversation from file
+    # Get user's current appointments from database while reading the conversation
+    appointments_future = _fetch_executor.submit(get_user_appointments, user_name)
     conversation_text = read_chat_history_from_file(user_name)
     
     if not conversation_text.strip():
         return "No consultation history available to summarize."
     
-    # Get user's current appointments from database
-    appointments = get_user_appointments(user_name)
+    appointments = appointments_future.result()
     
     # Create the prompt with chat history and appointments info
     system_message = SystemMessage(content=summary_agent_prompt)
@@ -110,11 +176,12 @@ def generate_consultation_summary(llm, user_name: str) -> str:
 CURRENT USER APPOINTMENTS (from database): {appointments}
 
 CONVERSATION HISTORY:
-{conversation_text}"""
+{_compact(conversation_text, max_turns=None, max_chars=None)}"""
     )
     
     try:
-        response = llm.invoke([system_message, user_message])
+        with timed("llm.consultation_summary"):
+            response = llm.invoke([system_message, user_message])
         return response.content
     except Exception as e:
         return f"Error generating summary: {str(e)}"
@@ -134,17 +201,36 @@ def generate_patient_problem_summary(llm, user_name: str) -> str:
     if not conversation_text.strip():
         return "General consultation"
     
+    key = (user_name.lower(), hashlib.blake2b(conversation_text.encode(), digest_size=16).hexdigest())
+    now = time.monotonic()
+    cached = _problem_cache.get(key)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+    
     # Create the prompt with chat history
     system_message = SystemMessage(content=patient_problem_prompt)
-    user_message = HumanMessage(content=conversation_text)
+    user_message = HumanMessage(content=_compact(conversation_text))
     
     try:
-        response = llm.invoke([system_message, user_message])
-        # Ensure the response is not too long (max 200 chars)
-        problem = response.content.strip()
-        if len(problem) > 200:
-            problem = problem[:197] + "..."
-        return problem if problem else "General consultation"
+        # Stream the answer and stop as soon as it exceeds the 200-char limit,
+        # instead of waiting for the model to finish text that would be cut off
+        text, truncated = "", False
+        with timed("llm.problem_summary"):
+            for chunk in llm.stream([system_message, user_message]):
+                text += chunk.content
+                if len(text.lstrip()) > 200:
+                    truncated = True
+                    break
+        problem = text.lstrip()[:197] + "..." if truncated else text.strip()
+        problem = problem if problem else "General consultation"
     except Exception as e:
-        print(f"Error generating patient problem summary: {e}")
+        log.error("Error generating patient problem summary: %s", e)
         return "General consultation"
+    
+    # Drop expired entries so the cache doesn't grow with every chat turn
+    for k, (expires_at, _) in list(_problem_cache.items()):
+        if expires_at <= now:
+            _problem_cache.pop(k, None)
+    _problem_cache[key] = (now + PROBLEM_CACHE_TTL, problem)
+    return problem
+
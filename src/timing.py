@@ -0,0 +1,60 @@
+"""
+Per-step latency measurements (SQLite, LLM, knowledge base search).
+Wrap a step in `with timed("llm.sql_agent"):` and its duration is logged at
+DEBUG and kept for the /metrics endpoint, so a slow reply can be traced to
+the step that caused it.
+"""
+
+import time
+import logging
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+log = logging.getLogger('healthassistant.timing')
+
+TIMING_WINDOW = 1000  # most recent samples kept per step for the percentiles
+
+_samples = defaultdict(lambda: deque(maxlen=TIMING_WINDOW))  # name -> durations (ns)
+_counts = defaultdict(int)  # name -> total calls since start
+_lock = threading.Lock()
+
+
+@contextmanager
+def timed(name: str):
+    """
+    Measure the duration of a with block under the given step name.
+    The time is recorded even if the block raises.
+
+    :param name: Step name, e.g. "sqlite.query_appointments".
+    """
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter_ns() - start
+        with _lock:
+            _samples[name].append(elapsed)
+            _counts[name] += 1
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("%s took %.1f ms", name, elapsed / 1e6)
+
+
+def render_metrics() -> str:
+    """
+    Render the recorded timings in the Prometheus text format: the total call
+    count per step and the p50/p95 of its recent durations, in seconds.
+    """
+    with _lock:
+        snapshot = {name: (sorted(samples), _counts[name]) for name, samples in _samples.items()}
+
+    lines = [
+        "# HELP healthassistant_step_seconds Duration of instrumented steps (recent samples).",
+        "# TYPE healthassistant_step_seconds summary",
+    ]
+    for name, (samples, count) in sorted(snapshot.items()):
+        for q in (0.5, 0.95):
+            value = samples[min(len(samples) - 1, int(q * len(samples)))] / 1e9
+            lines.append(f'healthassistant_step_seconds{{step="{name}",quantile="{q}"}} {value:.6f}')
+        lines.append(f'healthassistant_step_seconds_count{{step="{name}"}} {count}')
+    return "\n".join(lines) + "\n"